@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import os
+import secrets
+import select
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from .database import engine
+
+
+# Tables whose writes change /recipes/suggestions answers
+VERSIONED_TABLES = ["recipes", "ingredients", "instructions", "preferences", "diets"]
+# Writes that change which recipes and ingredients exist and which recipe
+# uses what also move the 'catalog' counter. On the tables listed here only
+# inserts, deletes and updates of these columns do: stock, price and expiry
+# updates leave it alone.
+CATALOG_COLUMNS = {"ingredients": ["name", "unit"]}
+
+VERSION_CHANNEL = "data_versions"
+
+# A NOTIFY instead of an UPDATE of a shared counter row: writers take no lock
+# on anything they share, and duplicates within a transaction fold into one
+_BUMP_VERSION = f"""
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{VERSION_CHANNEL}', name) FROM unnest(TG_ARGV) AS name;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+log = logging.getLogger(__name__)
+
+
+def install_version_triggers(connection):
+    """
+    Notify 'suggestions' on every write statement on VERSIONED_TABLES and
+    'catalog' on the catalog writes among them (see CATALOG_COLUMNS),
+    whichever process issues it. Notifications are delivered on commit, so a
+    version only moves once the data it stands for is visible. PostgreSQL only.
+    """
+    connection.execute(text(_BUMP_VERSION))
+    for table in VERSIONED_TABLES:
+        columns = CATALOG_COLUMNS.get(table)
+        counters = "'suggestions'" if columns else "'suggestions', 'catalog'"
+        connection.execute(text(f"""
+            CREATE OR REPLACE TRIGGER {table}_bump_data_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version({counters});
+        """))
+        if columns:
+            connection.execute(text(f"""
+                CREATE OR REPLACE TRIGGER {table}_bump_catalog_version
+                AFTER INSERT OR UPDATE OF {", ".join(columns)} OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('catalog');
+            """))
+
+
+class DataVersions:
+    """
+    This process's write counters, moved by the notifications of
+    bump_data_version() that a listener thread receives on a connection of
+    its own. Every process counts for itself, which is all its caches and
+    snapshots need. Until the listener is up (or while it reconnects) reads
+    return a new value each time, so nothing possibly stale is served. On
+    other databases there are no triggers and the counters stay put.
+    """
+
+    def __init__(self, names=("suggestions", "catalog")):
+        # a random start per process: ETags derived from the versions cannot
+        # match those of another worker or of before a restart
+        self._versions = dict.fromkeys(names, secrets.randbits(48) << 16)
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._thread = None
+
+    def get(self, name: str) -> int:
+        if self.listen() and not self._listening.is_set():
+            # never wait for it on the request path: until it listens, bypass the caches
+            self.bump()
+        with self._lock:
+            return self._versions[name]
+
+    def listen(self) -> bool:
+        """Start the listener thread if there is none yet; False when this database has no notifications."""
+        # on the sync engine: psycopg2 connections have poll() and notifies
+        if engine.dialect.name != "postgresql":
+            return False
+        self._start(engine)
+        return True
+
+    def bump(self, *names):
+        with self._lock:
+            for name in names or list(self._versions):
+                self._versions[name] += 1
+
+    def _start(self, engine):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, args=(engine,), name="data-versions", daemon=True)
+                self._thread.start()
+
+    def _listen(self, engine):
+        # a plain DBAPI connection outside the pool, for as long as the process lives
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        while True:
+            connection = None
+            try:
+                connection = engine.dialect.connect(*cargs, **cparams)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {VERSION_CHANNEL}")
+                # whatever committed before LISTEN took effect was never notified to us
+                self.bump()
+                self._listening.set()
+                while True:
+                    select.select([connection], [], [])
+                    connection.poll()
+                    names = {n.payload for n in connection.notifies} & set(self._versions)
+                    connection.notifies.clear()
+                    if names:
+                        self.bump(*names)
+            except Exception:
+                log.exception("data version listener lost its connection, reconnecting")
+                self._listening.clear()
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(1)
+
+
+data_versions = DataVersions()
+
+
+def data_version(name: str = "suggestions") -> int:
+    return data_versions.get(name)
+
+
+class ResponseCache:
+    """
+    Bounded LRU of encoded responses with a TTL. Keys carry the data version
+    and the date, so writes and midnight invalidate entries by making them
+    unreachable; LRU eviction and the TTL reclaim the space.
+    """
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def etag(key) -> str:
+        # Responses are a pure function of the key, so the ETag can be
+        # derived (and an If-None-Match answered) without computing them
+        return '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, stored_at = entry
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = (body, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+suggestion_cache = ResponseCache(
+    max_entries=int(os.getenv("SUGGESTION_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("SUGGESTION_CACHE_TTL", "300")),
+)
@@ -1,14 +1,120 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import time
 from dotenv import load_dotenv
 
+from .metrics import METRICS_ENABLED, record_pool_checkout, record_statement
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def _async_url(url):
+    # same database, async driver
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Pool sizing, shared by both engines (each gets its own pool of this size)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Server-side statement_timeout in milliseconds, 0 disables it
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+def _timed_pool(pool_class):
+    # connect() covers waiting for a free connection, opening a new one and the pre-ping
+    class TimedPool(pool_class):
+        def connect(self):
+            start = time.perf_counter()
+            connection = super().connect()
+            record_pool_checkout(self.logging_name, self, time.perf_counter() - start)
+            return connection
+
+    return TimedPool
+
+
+def _engine_options(url, name, pool_class):
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+    if METRICS_ENABLED:
+        options["poolclass"] = _timed_pool(pool_class)
+    return options
+
+
+def _timeout_args(url):
+    if not DB_STATEMENT_TIMEOUT_MS or make_url(url).get_backend_name() != "postgresql":
+        return {}
+    if make_url(url).get_driver_name() == "asyncpg":
+        return {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+
+
 # Connect to Postgres
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL, connect_args=_timeout_args(DATABASE_URL), **_engine_options(DATABASE_URL, "sync", QueuePool)
+)
+
+# Serves the request handlers (get_async_db) and ndjson streams; created on
+# first use, so seeding and scripts import this module without the async driver
+_async_engine = None
+_async_sessions = None
+
+
+def _time_statements(sync_engine, name):
+    # statement count, time and rows for /metrics, attributed to the current request (metrics.py)
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def finished(conn, cursor, statement, parameters, context, executemany):
+        record_statement(name, statement, time.perf_counter() - context._metrics_start, cursor.rowcount)
+
+
+if METRICS_ENABLED:
+    _time_statements(engine, "sync")
+
+
+def get_async_engine():
+    global _async_engine, _async_sessions
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            connect_args=_timeout_args(ASYNC_DATABASE_URL),
+            **_engine_options(ASYNC_DATABASE_URL, "async", AsyncAdaptedQueuePool),
+        )
+        if METRICS_ENABLED:
+            _time_statements(_async_engine.sync_engine, "async")
+        _async_sessions = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+async def dispose_async_engine():
+    # pooled asyncpg connections belong to the event loop that opened them
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -17,10 +123,23 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 class Base(DeclarativeBase):
     pass
 
-# Dependency to get DB session in FastAPI routes
+# Sync sessions, for seeding, scripts and the CPU-bound work handlers hand to
+# the threadpool (suggestion engine, search index, planner)
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def async_session():
+    """A new AsyncSession on the async engine."""
+    get_async_engine()
+    return _async_sessions()
+
+
+# Dependency to get DB session in FastAPI routes
+async def get_async_db():
+    async with async_session() as db:
+        yield db
@@ -0,0 +1,105 @@
+from typing import List
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .triggers import changed_rows_trigger
+
+
+# A bigint holds 63 usable bits
+MAX_COMPONENTS = 63
+
+_REGISTER_COMPONENTS = f"""
+CREATE OR REPLACE FUNCTION register_components(components text[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO problematic_components (component, bit)
+    SELECT c, (SELECT COALESCE(MAX(bit), -1) FROM problematic_components) + ROW_NUMBER() OVER (ORDER BY c)
+    FROM (SELECT DISTINCT unnest(components) AS c) new_components
+    WHERE c IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM problematic_components p WHERE p.component = c);
+    IF (SELECT MAX(bit) FROM problematic_components) >= {MAX_COMPONENTS} THEN
+        RAISE EXCEPTION 'more than {MAX_COMPONENTS} problematic components';
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_REFRESH_EXCLUSIONS = """
+CREATE OR REPLACE FUNCTION refresh_recipe_exclusions(recipe_names text[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM recipe_exclusions WHERE recipe = ANY(recipe_names);
+    INSERT INTO recipe_exclusions (recipe, mask)
+    SELECT r.name, COALESCE(bit_or(1::bigint << c.bit), 0)
+    FROM recipes r
+    LEFT JOIN instructions m ON m.recipe = r.name
+    LEFT JOIN preferences p ON p.article = m.ingredient
+    LEFT JOIN problematic_components c ON c.component = p.problematic_component
+    WHERE r.name = ANY(recipe_names)
+    GROUP BY r.name;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def install_exclusion_triggers(connection):
+    """
+    Create the functions and triggers maintaining recipe_exclusions, the
+    recipe -> problematic component bitmask built from instructions x
+    preferences, then fill it. Only the recipes touched by a statement are
+    recomputed. PostgreSQL only.
+    """
+    statements = [_REGISTER_COMPONENTS, _REFRESH_EXCLUSIONS]
+    statements += changed_rows_trigger(
+        "recipes", "exclusions_refresh", "name", ["name"],
+        ["PERFORM refresh_recipe_exclusions(changed)"],
+    )
+    statements += changed_rows_trigger(
+        "instructions", "exclusions_refresh", "recipe", ["recipe", "ingredient"],
+        ["PERFORM refresh_recipe_exclusions(changed)"],
+    )
+    statements += changed_rows_trigger(
+        "preferences", "exclusions_refresh", "article", ["article", "problematic_component"],
+        [
+            "PERFORM register_components(ARRAY(SELECT problematic_component FROM preferences WHERE article = ANY(changed)))",
+            "PERFORM refresh_recipe_exclusions(ARRAY(SELECT DISTINCT recipe FROM instructions WHERE ingredient = ANY(changed)))",
+        ],
+    )
+    for statement in statements:
+        connection.execute(text(statement))
+    connection.execute(text("SELECT register_components(ARRAY(SELECT problematic_component FROM preferences))"))
+    connection.execute(text("SELECT refresh_recipe_exclusions(ARRAY(SELECT name FROM recipes))"))
+
+
+DIET_MASKS_SQL = text("""
+    SELECT d.diet, COALESCE(bit_or(1::bigint << c.bit), 0) AS mask
+    FROM diets d
+    LEFT JOIN problematic_components c ON c.component = d.problematic_component
+    GROUP BY d.diet
+""")
+
+
+def load_diet_masks(db: Session) -> dict:
+    return {row.diet: row.mask for row in db.execute(DIET_MASKS_SQL)}
+
+
+def combine_masks(diet_masks: dict, diets: List[str]) -> int:
+    """
+    OR of the component bits of the given diets; a recipe fits all of them
+    when recipe mask & diet mask == 0. Unknown diets are a 400.
+    """
+    unknown = set(diets) - set(diet_masks)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown diets: {', '.join(sorted(unknown))}")
+    mask = 0
+    for diet in diets:
+        mask |= diet_masks[diet]
+    return mask
+
+
+async def diet_mask(db: AsyncSession, diets: List[str]) -> int:
+    if not diets:
+        return 0
+    result = await db.execute(DIET_MASKS_SQL)
+    return combine_masks({row.diet: row.mask for row in result}, diets)
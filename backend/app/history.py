@@ -0,0 +1,318 @@
+import argparse
+from datetime import date, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import MenuPlanArchive
+from .schemas import IngredientConsumption, RecipeFrequency, WeeklyCost
+from .serialization import json_encoder, json_response
+
+
+# Menu plan history: monthly partitions, analytics and archiving.
+#
+# On PostgreSQL menu_plan is partitioned by month (menu_plan_YYYY_MM, see
+# models.py), so a date range only reads the months it covers and old months
+# go away by dropping their partition. Rows of months without a partition
+# land in menu_plan_default until ensure_partitions() moves them out.
+#
+# Old days can be rolled into menu_plan_archive, one row per recipe and week
+# with the planned meals and portions summed. Costs, recipe counts and
+# ingredient consumption are all linear in the portions, so the analytics
+# below stay exact at week granularity over archived weeks, which count as a
+# whole when the range starts within them.
+#
+#    python -m app.history --keep-months 24      # archive everything older
+#    python -m app.history --before 2024-01-01
+#
+# PostgreSQL only.
+
+
+_ENSURE_PARTITIONS = """
+CREATE OR REPLACE FUNCTION ensure_menu_plan_partitions(first_day date, last_day date) RETURNS integer AS $$
+DECLARE
+    month date;
+    partition text;
+    created integer := 0;
+BEGIN
+    -- concurrent callers would race for the same CREATE TABLE
+    PERFORM pg_advisory_xact_lock(hashtext('menu_plan_partitions'));
+    FOR month IN
+        SELECT generate_series(date_trunc('month', first_day), date_trunc('month', last_day), interval '1 month')::date
+    LOOP
+        partition := 'menu_plan_' || to_char(month, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(partition) IS NOT NULL;
+        EXECUTE format('CREATE TABLE %I (LIKE menu_plan INCLUDING DEFAULTS)', partition);
+        -- the month's rows in the default partition would make the ATTACH fail
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM menu_plan_default WHERE date >= %L AND date < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            month, (month + interval '1 month')::date, partition
+        );
+        EXECUTE format(
+            'ALTER TABLE menu_plan ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition, month, (month + interval '1 month')::date
+        );
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def install_menu_plan_partitions(connection):
+    """Install ensure_menu_plan_partitions() and partition the rows already loaded."""
+    connection.execute(text(_ENSURE_PARTITIONS))
+    return ensure_partitions(connection)
+
+
+def ensure_partitions(db, first: Optional[date] = None, last: Optional[date] = None) -> int:
+    """
+    Create the monthly partitions from first to last, by default the months
+    of the rows sitting in menu_plan_default. Returns how many were created.
+    """
+    if first is None:
+        first, last = db.execute(text("SELECT MIN(date), MAX(date) FROM menu_plan_default")).one()
+        if first is None:
+            return 0
+    return db.execute(
+        text("SELECT ensure_menu_plan_partitions(:first, :last)"), {"first": first, "last": last}
+    ).scalar_one()
+
+
+# Planned meals in the range: live days plus the archived weeks overlapping it.
+# `times` is the number of meals a row stands for.
+_HISTORY = """
+    history AS (
+        SELECT date AS day, meal, 1 AS times, portions
+        FROM menu_plan
+        WHERE date BETWEEN :start_date AND :end_date
+        UNION ALL
+        SELECT week, meal, times, portions
+        FROM menu_plan_archive
+        WHERE week BETWEEN CAST(:start_date AS date) - 6 AND :end_date
+    )
+"""
+
+# Price of one portion of every recipe in the history, at current prices
+_PRICES = """
+    prices AS (
+        SELECT m.recipe, SUM(m.quantity * i.price_per_unit) / MIN(r.portions) AS per_portion
+        FROM recipes r
+        JOIN instructions m ON m.recipe = r.name
+        JOIN ingredients i ON i.name = m.ingredient AND i.unit = m.unit
+        WHERE r.name IN (SELECT meal FROM history)
+        GROUP BY m.recipe
+    )
+"""
+
+# One scan of the range; the running total and the 4-week moving average are
+# window aggregates over the weekly sums. Weeks without meals are left out.
+WEEKLY_COST_SQL = text(f"""
+    WITH {_HISTORY}, {_PRICES}
+    SELECT
+        date_trunc('week', h.day)::date                                         AS week,
+        SUM(h.times)                                                            AS meals,
+        SUM(h.portions)                                                         AS portions,
+        ROUND(SUM(h.portions * COALESCE(p.per_portion, 0))::numeric, 2)         AS cost,
+        ROUND(SUM(SUM(h.portions * COALESCE(p.per_portion, 0))) OVER running::numeric, 2) AS cumulative_cost,
+        ROUND(AVG(SUM(h.portions * COALESCE(p.per_portion, 0))) OVER last_4::numeric, 2)  AS moving_average_cost
+    FROM history h
+    LEFT JOIN prices p ON p.recipe = h.meal
+    GROUP BY 1
+    WINDOW
+        running AS (ORDER BY date_trunc('week', h.day)::date),
+        last_4 AS (ORDER BY date_trunc('week', h.day)::date ROWS BETWEEN 3 PRECEDING AND CURRENT ROW)
+    ORDER BY week
+""")
+
+TOP_RECIPES_SQL = text(f"""
+    WITH {_HISTORY}
+    SELECT
+        meal                                                                    AS recipe,
+        RANK() OVER (ORDER BY SUM(times) DESC)                                  AS rank,
+        SUM(times)                                                              AS times,
+        SUM(portions)                                                           AS portions,
+        ROUND(SUM(times)::numeric / SUM(SUM(times)) OVER (), 4)                 AS share,
+        MIN(day)                                                                AS first_planned,
+        MAX(day)                                                                AS last_planned
+    FROM history
+    GROUP BY meal
+    ORDER BY rank, recipe
+    LIMIT :limit
+""")
+
+# Consumption per ingredient and period, with running totals and a moving
+# average per ingredient. The plan is summed per period and recipe before the
+# instruction join, and the windows only run over the :limit ingredients
+# costing the most over the whole range. Quantities pool in grams over every
+# unit of an ingredient (see units.py), like stock and the shopping list, and
+# are reported in the unit that is cheapest per gram.
+INGREDIENT_CONSUMPTION_SQL = text(f"""
+    WITH {_HISTORY},
+    plan AS (
+        SELECT date_trunc(:bucket, day)::date AS period, meal, SUM(portions) AS portions
+        FROM history
+        GROUP BY 1, 2
+    ),
+    consumption AS (
+        SELECT
+            p.period,
+            m.ingredient,
+            SUM(m.quantity_in_grams * p.portions / r.portions)                  AS grams,
+            SUM(m.quantity * p.portions / r.portions * i.price_per_unit)        AS cost
+        FROM plan p
+        JOIN recipes r ON r.name = p.meal
+        JOIN instructions m ON m.recipe = p.meal
+        JOIN ingredients i ON i.name = m.ingredient AND i.unit = m.unit
+        WHERE CAST(:ingredients AS text[]) IS NULL OR m.ingredient = ANY(CAST(:ingredients AS text[]))
+        GROUP BY 1, 2
+    ),
+    top AS (
+        SELECT ingredient, ROW_NUMBER() OVER (ORDER BY SUM(cost) DESC, ingredient) AS rank
+        FROM consumption
+        GROUP BY ingredient
+        ORDER BY rank
+        LIMIT :limit
+    ),
+    report_unit AS (
+        SELECT DISTINCT ON (name) name, unit, g_per_unit
+        FROM ingredients
+        WHERE name IN (SELECT ingredient FROM top)
+        ORDER BY name, price_per_unit / g_per_unit, unit
+    )
+    SELECT
+        c.period,
+        c.ingredient,
+        u.unit,
+        c.grams / u.g_per_unit                                                  AS quantity,
+        c.grams                                                                 AS quantity_in_grams,
+        ROUND(c.cost::numeric, 2)                                               AS cost,
+        SUM(c.grams) OVER running / u.g_per_unit                                AS cumulative_quantity,
+        ROUND(SUM(c.cost) OVER running::numeric, 2)                             AS cumulative_cost,
+        AVG(c.grams) OVER last_4 / u.g_per_unit                                 AS moving_average_quantity
+    FROM consumption c
+    JOIN top t ON t.ingredient = c.ingredient
+    JOIN report_unit u ON u.name = c.ingredient
+    WINDOW
+        running AS (PARTITION BY t.rank ORDER BY c.period),
+        last_4 AS (PARTITION BY t.rank ORDER BY c.period ROWS BETWEEN 3 PRECEDING AND CURRENT ROW)
+    ORDER BY t.rank, c.period
+""")
+
+weekly_cost_encoder = json_encoder(WeeklyCost)
+top_recipes_encoder = json_encoder(RecipeFrequency)
+consumption_encoder = json_encoder(IngredientConsumption)
+
+
+async def _rows(db: AsyncSession, sql, params) -> List[dict]:
+    # These run on get_async_db, and the asyncpg dialect keeps the statements
+    # it prepares per connection. After five executions PostgreSQL may switch
+    # a prepared statement to a generic plan: no partition pruning at plan
+    # time and row estimates that ignore the range, twice as slow over years
+    # of history. Plan every call for this transaction only.
+    await db.execute(text("SET LOCAL plan_cache_mode = force_custom_plan"))
+    result = await db.execute(sql, params)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+async def weekly_cost(db: AsyncSession, start_date: date, end_date: date):
+    """Cost of the planned meals per week at current prices, with running totals."""
+    rows = await _rows(db, WEEKLY_COST_SQL, {"start_date": start_date, "end_date": end_date})
+    return json_response(weekly_cost_encoder, rows)
+
+
+async def top_recipes(db: AsyncSession, start_date: date, end_date: date, limit: int):
+    """The most planned recipes in the range and their share of all meals."""
+    rows = await _rows(db, TOP_RECIPES_SQL, {"start_date": start_date, "end_date": end_date, "limit": limit})
+    return json_response(top_recipes_encoder, rows)
+
+
+async def ingredient_consumption(
+    db: AsyncSession, start_date: date, end_date: date, bucket: str, ingredients: Optional[List[str]], limit: int
+):
+    """Ingredient quantities the menu plan used per week or month."""
+    rows = await _rows(db, INGREDIENT_CONSUMPTION_SQL, {
+        "start_date": start_date,
+        "end_date": end_date,
+        "bucket": bucket,
+        "ingredients": ingredients or None,
+        "limit": limit,
+    })
+    return json_response(consumption_encoder, rows)
+
+
+ARCHIVE_SQL = text("""
+    INSERT INTO menu_plan_archive (week, meal, times, portions)
+    SELECT date_trunc('week', date)::date, meal, COUNT(*), SUM(portions)
+    FROM menu_plan
+    WHERE date < :before
+    GROUP BY 1, 2
+    ON CONFLICT (week, meal) DO UPDATE SET
+        times = menu_plan_archive.times + excluded.times,
+        portions = menu_plan_archive.portions + excluded.portions
+""")
+
+# Partitions holding only days before :before
+_OLD_PARTITIONS = text(r"""
+    SELECT c.relname
+    FROM pg_inherits
+    JOIN pg_class c ON c.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'menu_plan'::regclass
+      AND c.relname ~ '^menu_plan_\d{4}_\d{2}$'
+      AND to_date(substr(c.relname, 11), 'YYYY_MM') + interval '1 month' <= :before
+    ORDER BY c.relname
+""")
+
+
+def archive_menu_plan(connection, before: date, report=print) -> dict:
+    """
+    Roll the menu plan days before `before` into menu_plan_archive and
+    delete them: whole months by dropping their partition, the rest row by
+    row. Runs in the caller's transaction.
+
+    A reseed starts the archive over; a --sync leaves the archived weeks
+    alone (see archive_cutoff).
+    """
+    days = connection.execute(text("SELECT COUNT(*) FROM menu_plan WHERE date < :before"), {"before": before}).scalar_one()
+    summaries = connection.execute(ARCHIVE_SQL, {"before": before}).rowcount
+    partitions = connection.execute(_OLD_PARTITIONS, {"before": before}).scalars().all()
+    for partition in partitions:
+        connection.execute(text(f'DROP TABLE "{partition}"'))
+    connection.execute(text("DELETE FROM menu_plan WHERE date < :before"), {"before": before})
+    totals = {"meals": days, "summary_rows": summaries, "partitions_dropped": len(partitions)}
+    report(f"archived {days} planned meals before {before} into {summaries} weekly rows, "
+           f"dropped {len(partitions)} partitions")
+    return totals
+
+
+def archive_cutoff(connection) -> Optional[date]:
+    """
+    The Monday after the last archived week, or None without an archive.
+    Days before it are accounted for in menu_plan_archive and must not come
+    back into menu_plan.
+    """
+    last = connection.execute(select(func.max(MenuPlanArchive.week))).scalar()
+    return last + timedelta(days=7) if last else None
+
+
+def months_ago(months: int) -> date:
+    today = date.today()
+    month = today.year * 12 + today.month - 1 - months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Archive old menu plan days into weekly summary rows.")
+    cutoff = parser.add_mutually_exclusive_group(required=True)
+    cutoff.add_argument("--before", type=date.fromisoformat, help="archive the days before this date")
+    cutoff.add_argument("--keep-months", type=int, help="keep this many months before the current one")
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        archive_menu_plan(connection, args.before or months_ago(args.keep_months))
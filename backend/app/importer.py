@@ -0,0 +1,352 @@
+import csv
+import io
+import itertools
+import os
+import time
+from datetime import date
+
+from sqlalchemy import String, inspect, select, text, tuple_
+from sqlalchemy.schema import AddConstraint, CreateIndex, DropIndex
+
+from .history import archive_cutoff
+from .models import Nutrient, Ingredient, Recipe, Instruction, Diet, Preference, MenuPlan
+
+
+DATA_DIR = os.getenv("SEED_DATA_DIR", "data")
+# Rows per executemany() call on databases without COPY
+BATCH_SIZE = 10_000
+
+
+def parse_date(date_str):
+    if not date_str or date_str.lower() == 'none':
+        return None
+    # same as strptime(date_str, "%Y/%m/%d") at a fraction of the cost
+    year, month, day = date_str.split("/")
+    return date(int(year), int(month), int(day))
+
+
+def _float(value):
+    return float(value)
+
+
+def _int(value):
+    return int(value)
+
+
+def _str(value):
+    return value
+
+
+# One entry per CSV, in foreign key dependency order:
+#   (file, model, {db column: (csv column, converter)})
+TABLE_SPECS = [
+    ("nutrients.csv", Nutrient, {
+        "ingredient_group": ("Ingredient_Group", _str),
+        "kcal": ("kcal", _float),
+        "kj": ("kJ", _float),
+        "fat": ("graisses", _float),
+        "saturated_fatty_acids": ("acides_gras_satures", _float),
+        "mono_unsaturated_fatty_acids": ("acides_gras_mono_insatures", _float),
+        "polyunsaturated_fatty_acids": ("acides_gras_polyinsatures", _float),
+        "cholesterol_mg": ("cholesterol_mg", _float),
+        "carbohydrates": ("glucides", _float),
+        "sugar": ("sucres", _float),
+        "starch": ("amidon", _float),
+        "dietary_fibre": ("fibres_alimentaires", _float),
+        "protein": ("proteines", _float),
+        "salt": ("sel", _float),
+    }),
+    ("ingredients.csv", Ingredient, {
+        "name": ("Ingredient", _str),
+        "group": ("Group", _str),
+        "unit": ("Unit", _str),
+        "g_per_unit": ("g_Per_Unit", _float),
+        "price_per_unit": ("Price_Per_Unit", _float),
+        "store": ("Store", _str),
+        "quantity_on_stock": ("Quantity_On_Stock", _float),
+        "expiration_date": ("Expiration_Date", parse_date),
+    }),
+    ("recipes.csv", Recipe, {
+        "name": ("Nom", _str),
+        "description": ("Instructions", _str),
+        "portions": ("Portions", _int),
+    }),
+    ("instructions.csv", Instruction, {
+        "recipe": ("Recipe", _str),
+        "ingredient": ("Ingredient", _str),
+        "quantity": ("Quantity", _float),
+        "unit": ("Unit", _str),
+        "preparation": ("Preparation", _str),
+    }),
+    ("diets.csv", Diet, {
+        "diet": ("Diet", _str),
+        "problematic_component": ("Problematic_Component", _str),
+    }),
+    ("preferences.csv", Preference, {
+        "article": ("Ingredient", _str),
+        "problematic_component": ("Problematic_Component", _str),
+    }),
+    ("menu_plan.csv", MenuPlan, {
+        "date": ("Date", parse_date),
+        "meal": ("Meal", _str),
+        "portions": ("Portions", _int),
+    }),
+]
+
+
+def read_tuples(path, columns):
+    """Stream a CSV as converted tuples, in the order of the columns mapping."""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        try:
+            fields = [(header.index(source), convert) for source, convert in columns.values()]
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from e
+        for line, row in enumerate(reader, start=2):
+            try:
+                yield tuple(convert(row[i]) for i, convert in fields)
+            except (IndexError, ValueError, TypeError) as e:
+                raise ValueError(f"{path}:{line}: {e!r}") from e
+
+
+def read_rows(path, columns):
+    """Stream a CSV as converted dicts keyed by db column."""
+    keys = list(columns)
+    for values in read_tuples(path, columns):
+        yield dict(zip(keys, values))
+
+
+class _CopyStream:
+    """File-like object feeding COPY FROM STDIN (CSV format) from row tuples."""
+
+    def __init__(self, rows, chunk_rows=5_000):
+        self._rows = iter(rows)
+        self._chunk_rows = chunk_rows
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator="\n")
+        self._buffer = ""
+        self.count = 0
+
+    def _fill(self):
+        self._out.seek(0)
+        self._out.truncate()
+        batch = list(itertools.islice(self._rows, self._chunk_rows))
+        self._writer.writerows(batch)
+        self.count += len(batch)
+        return self._out.getvalue()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._fill()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    readline = read
+
+
+def _copy_rows(connection, table, columns, rows):
+    # Python's csv writer leaves both None and "" unquoted, which COPY reads as
+    # NULL; text columns are never NULL in the CSVs, so FORCE_NOT_NULL keeps
+    # their empty strings and only dates map to NULL.
+    texts = [c for c in columns if isinstance(table.columns[c].type, String)]
+    quoted = ", ".join(f'"{c}"' for c in columns)
+    options = "FORMAT csv"
+    if texts:
+        options += ", FORCE_NOT_NULL (" + ", ".join(f'"{c}"' for c in texts) + ")"
+    stream = _CopyStream(rows)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({quoted}) FROM STDIN WITH ({options})', stream, size=1 << 16)
+    finally:
+        cursor.close()
+    return stream.count
+
+
+def _insert_rows(connection, table, columns, rows):
+    count, batch = 0, []
+    for values in rows:
+        batch.append(dict(zip(columns, values)))
+        if len(batch) >= BATCH_SIZE:
+            connection.execute(table.insert(), batch)
+            count, batch = count + len(batch), []
+    if batch:
+        connection.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def load_table(connection, model, columns, rows):
+    """
+    Bulk load value tuples for the given columns into the model's table: COPY
+    FROM STDIN on PostgreSQL, batched executemany INSERTs elsewhere.
+    Returns the row count.
+    """
+    table = model.__table__
+    if connection.dialect.name == "postgresql":
+        return _copy_rows(connection, table, columns, rows)
+    return _insert_rows(connection, table, columns, rows)
+
+
+def _drop_foreign_keys(connection, tables):
+    """Drop the FK constraints of the given tables; returns the metadata
+    constraints to re-create once the data is in."""
+    dropped = []
+    inspector = inspect(connection)
+    for table in tables:
+        for fk in inspector.get_foreign_keys(table.name):
+            connection.execute(text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{fk["name"]}"'))
+        dropped.extend(table.foreign_key_constraints)
+    return dropped
+
+
+def _drop_indexes(connection, tables):
+    """Drop the secondary indexes of the given tables; returns them for
+    re-creation. Primary keys stay, they back the FK checks."""
+    dropped = []
+    for table in tables:
+        for index in table.indexes:
+            # indexes restricted to other dialects (Index.ddl_if) were never created
+            if index._ddl_if is not None and index._ddl_if.dialect not in (None, connection.dialect.name):
+                continue
+            connection.execute(DropIndex(index, if_exists=True))
+            dropped.append(index)
+    return dropped
+
+
+def import_all(connection, data_dir=DATA_DIR, report=print):
+    """
+    Load every CSV of TABLE_SPECS in dependency order into empty tables on
+    the given connection. The caller owns the transaction, so the import is
+    atomic.
+
+    On PostgreSQL the foreign keys and secondary indexes are dropped for the
+    load and re-added at the end: validating the keys and building each index
+    in one pass is much cheaper than maintaining them row by row during COPY.
+    """
+    postgres = connection.dialect.name == "postgresql"
+    foreign_keys, indexes = [], []
+    if postgres:
+        tables = [model.__table__ for _, model, _ in TABLE_SPECS]
+        foreign_keys = _drop_foreign_keys(connection, tables)
+        indexes = _drop_indexes(connection, tables)
+
+    totals = {}
+    for filename, model, columns in TABLE_SPECS:
+        start = time.perf_counter()
+        path = os.path.join(data_dir, filename)
+        count = load_table(connection, model, list(columns), read_tuples(path, columns))
+        elapsed = time.perf_counter() - start
+        totals[model.__tablename__] = count
+        report(f"{model.__tablename__:<12} {count:>10} rows in {elapsed:7.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    if indexes:
+        start = time.perf_counter()
+        for index in indexes:
+            connection.execute(CreateIndex(index))
+        report(f"{'indexes':<12} {len(indexes):>10} built in {time.perf_counter() - start:8.2f}s")
+    if foreign_keys:
+        start = time.perf_counter()
+        for fk in foreign_keys:
+            connection.execute(AddConstraint(fk))
+        report(f"{'foreign keys':<12} {len(foreign_keys):>10} validated in {time.perf_counter() - start:5.2f}s")
+    return totals
+
+
+def _upsert(connection, table, columns, pk, rows):
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    others = [c for c in columns if c not in pk]
+    if others:
+        stmt = stmt.on_conflict_do_update(index_elements=pk, set_={c: stmt.excluded[c] for c in others})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=pk)
+    for i in range(0, len(rows), BATCH_SIZE):
+        connection.execute(stmt, [dict(zip(columns, values)) for values in rows[i:i + BATCH_SIZE]])
+
+
+def _delete(connection, table, pk, keys):
+    pk_columns = [table.columns[c] for c in pk]
+    for i in range(0, len(keys), BATCH_SIZE):
+        connection.execute(table.delete().where(tuple_(*pk_columns).in_(keys[i:i + BATCH_SIZE])))
+
+
+def diff_table(connection, model, columns, path):
+    """
+    Compare a CSV with the current table content by primary key. Returns
+    (rows to insert, rows to update, keys to delete, number unchanged).
+    """
+    table = model.__table__
+    names = list(columns)
+    pk_pos = [names.index(c.name) for c in table.primary_key.columns]
+
+    current = {}
+    for row in connection.execute(select(*[table.columns[c] for c in names])):
+        values = tuple(row)
+        current[tuple(values[i] for i in pk_pos)] = values
+
+    inserted, updated, unchanged = [], [], 0
+    for values in read_tuples(path, columns):
+        old = current.pop(tuple(values[i] for i in pk_pos), None)
+        if old is None:
+            inserted.append(values)
+        elif old != values:
+            updated.append(values)
+        else:
+            unchanged += 1
+    # whatever is left is no longer in the CSV
+    return inserted, updated, list(current), unchanged
+
+
+def sync_all(connection, data_dir=DATA_DIR, report=print):
+    """
+    Bring the tables in line with the CSVs without dropping anything: rows
+    are diffed by primary key and only the changed ones are upserted
+    (INSERT ... ON CONFLICT DO UPDATE) or deleted. Views stay in place and
+    readers are never blocked by a table lock.
+
+    menu_plan is only ever added to: it also holds the days saved by the
+    planner, and the days before history.archive_cutoff() are already counted
+    in menu_plan_archive, so CSV rows for them are skipped.
+
+    Upserts run parents first and deletes children first, so the foreign
+    keys hold at every step. Returns {table: {inserted, updated, deleted,
+    unchanged, skipped}}.
+    """
+    totals, deletes = {}, []
+    for filename, model, columns in TABLE_SPECS:
+        table = model.__table__
+        pk = [c.name for c in table.primary_key.columns]
+        inserted, updated, deleted, unchanged = diff_table(
+            connection, model, columns, os.path.join(data_dir, filename)
+        )
+        skipped = 0
+        if model is MenuPlan:
+            deleted = []
+            cutoff = archive_cutoff(connection)
+            if cutoff is not None:
+                day = list(columns).index("date")
+                live = [values for values in inserted if values[day] >= cutoff]
+                skipped, inserted = len(inserted) - len(live), live
+        _upsert(connection, table, list(columns), pk, inserted + updated)
+        deletes.append((table, pk, deleted))
+        totals[table.name] = {
+            "inserted": len(inserted),
+            "updated": len(updated),
+            "deleted": len(deleted),
+            "unchanged": unchanged,
+            "skipped": skipped,
+        }
+        report(f"{table.name:<12} " + "  ".join(f"{k} {v:>7}" for k, v in totals[table.name].items()))
+
+    for table, pk, keys in reversed(deletes):
+        _delete(connection, table, pk, keys)
+    return totals
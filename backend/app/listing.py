@@ -0,0 +1,174 @@
+import base64
+import json
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import inspect, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .database import async_session
+from .metrics import serializing
+from .serialization import json_encoder, json_response
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+
+# Response schema of each listed table; its field types drive the encoder
+ROW_SCHEMAS = {
+    models.Recipe: schemas.Recipe,
+    models.Ingredient: schemas.Ingredient,
+    models.Instruction: schemas.Instruction,
+    models.Nutrient: schemas.Nutrient,
+}
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps(list(values), default=_json_default).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _cursor_value(column, value):
+    kind = column.type.python_type
+    # dates travel as ISO strings
+    if issubclass(kind, date):
+        return date.fromisoformat(value)
+    if kind is float and type(value) is int:
+        return float(value)
+    if type(value) is not kind:
+        raise TypeError(f"{column.key} is a {kind.__name__}, not {type(value).__name__}")
+    return value
+
+
+def decode_cursor(token: str, pk_columns) -> list:
+    """The primary key values of a cursor, each checked against its column type (400 otherwise)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if not isinstance(values, list) or len(values) != len(pk_columns):
+            raise ValueError(token)
+        return [_cursor_value(c, v) for c, v in zip(pk_columns, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _selected_columns(model, fields: Optional[str]):
+    columns = {c.key: c for c in inspect(model).columns}
+    if not fields:
+        return list(columns.values())
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return [columns[n] for n in names]
+
+
+def _keyset_query(model, fields, after, filters, conditions):
+    """
+    SELECT the requested columns (plus the primary key, needed for the
+    cursor) ordered by primary key, starting strictly after the cursor.
+    """
+    pk = list(inspect(model).primary_key)
+    columns = _selected_columns(model, fields)
+    extra = [c for c in pk if c not in columns]
+    stmt = select(*columns, *extra).order_by(*pk)
+    for name, value in (filters or {}).items():
+        if value is not None:
+            stmt = stmt.where(getattr(model, name) == value)
+    for condition in conditions:
+        stmt = stmt.where(condition)
+    if after:
+        stmt = stmt.where(tuple_(*pk) > tuple_(*decode_cursor(after, pk)))
+    return stmt, [c.key for c in columns], [c.key for c in pk]
+
+
+async def list_page(
+    db: AsyncSession,
+    model,
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    filters: Optional[dict] = None,
+    conditions=(),
+):
+    """
+    One keyset page as a JSON array response. When more rows follow, the
+    cursor for the next page is returned in the X-Next-Cursor header.
+    Without limit and cursor every row is returned, unpaginated, streamed
+    as one JSON array from a server-side cursor.
+    """
+    stmt, keys, pk_keys = _keyset_query(model, fields, after, filters, conditions)
+    if limit is None and after is None:
+        return _stream(stmt, model, keys, array=True)
+
+    headers = {}
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    # one extra row tells us whether there is a next page
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        headers["X-Next-Cursor"] = encode_cursor(last[k] for k in pk_keys)
+    # the selected columns come first, any extra key columns after them
+    return json_response(
+        json_encoder(ROW_SCHEMAS[model], tuple(keys)), [dict(zip(keys, row)) for row in rows], headers,
+    )
+
+
+def stream_ndjson(
+    model,
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    filters: Optional[dict] = None,
+    conditions=(),
+):
+    """
+    Stream rows as newline-delimited JSON from a server-side cursor, so memory
+    stays bounded by STREAM_BATCH_SIZE whatever the table size. Runs on its own
+    AsyncSession, open for as long as the stream.
+    """
+    stmt, keys, _ = _keyset_query(model, fields, after, filters, conditions)
+    if limit:
+        stmt = stmt.limit(limit)
+    return _stream(stmt, model, keys, array=False)
+
+
+def _stream(stmt, model, keys, array: bool):
+    # rows as newline-delimited JSON, or as the elements of one JSON array
+    encoder = json_encoder(ROW_SCHEMAS[model], tuple(keys), many=False)
+
+    async def generate():
+        if array:
+            yield b"["
+        first = True
+        async with async_session() as db:
+            result = await db.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+            try:
+                async for partition in result.partitions():
+                    with serializing():
+                        rows = [encoder.dump_json(dict(zip(keys, row))) for row in partition]
+                        if not array:
+                            chunk = b"".join([r + b"\n" for r in rows])
+                        elif first:
+                            chunk = b",".join(rows)
+                        else:
+                            chunk = b"," + b",".join(rows)
+                    first = False
+                    yield chunk
+            finally:
+                await result.close()
+        if array:
+            yield b"]"
+
+    return StreamingResponse(generate(), media_type="application/json" if array else "application/x-ndjson")
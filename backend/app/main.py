@@ -1,15 +1,45 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from .database import get_db
-from .models import Recipe, Ingredient, Instruction, Nutrient
-from .schemas import SuggestionRequest, RecipeAvailability
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from .database import SessionLocal, dispose_async_engine, get_async_db
+from .models import Recipe, Ingredient, Instruction, Nutrient, RecipeExclusion
+from . import schemas
+from .schemas import (
+    SuggestionRequest, SuggestionBatchRequest, RecipeAvailability, ScenarioSuggestions, ShoppingList,
+    StockRequest, StockChange, SearchResult, PlanRequest, MenuPlanProposal, RecipeDetail,
+    WeeklyCost, RecipeFrequency, IngredientConsumption,
+)
+from .suggestions import suggestion_engine
+from .listing import list_page, stream_ndjson
+from .nutrition import nutrition_report
+from .shopping import shopping_list
+from .stock import consume_stock
+from .planner import plan_menu
+from .history import ingredient_consumption, top_recipes, weekly_cost
+from .recipes import parse_include, recipe_detail, recipe_details_page
+from .search import MAX_SEARCH_RESULTS, search_index
+from .diets import diet_mask
+from .cache import data_version, data_versions, suggestion_cache
+from .metrics import METRICS_ENABLED, InstrumentedJSONResponse, MetricsMiddleware, profiler, render_metrics
+from .serialization import encode, json_encoder
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Union
+from datetime import date
 import os
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # so the version listener is usually up before the first request
+    data_versions.listen()
+    yield
+    await dispose_async_engine()
+
+
+app = FastAPI(default_response_class=InstrumentedJSONResponse, lifespan=lifespan)
 
 # Setup CORS so React can talk to us
 app.add_middleware(
@@ -17,94 +47,457 @@ app.add_middleware(
     allow_origins=[os.getenv("CORS_ORIGINS")],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# Outermost, so latency covers CORS too (see metrics.py)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if profiler:
+    profiler.start()
 
+# Handlers await their queries on an AsyncSession (get_async_db). Only the
+# CPU-bound work, the suggestion engine, the search index and the planner,
+# runs in the threadpool through run_in_threadpool(), on a sync Session of
+# its own, so it never blocks the event loop.
 @app.get("/health")
-def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     return {"status": "connected", "database": "PostgreSQL"}
 
 
-@app.get("/recipes")
-def get_recipes(db: Session = Depends(get_db)):
-    # Standard query - this will return recipes 
-    return db.query(Recipe).all()
+# All list endpoints are keyset-paginated on the primary key (see listing.py):
+#   ?limit=       page size (max 1000; 100 once ?after= is given); without limit
+#                 or after the whole table comes back as one JSON array, streamed
+#                 from a server-side cursor
+#   ?after=       cursor taken from the X-Next-Cursor header of the previous page
+#   ?fields=      comma separated projection, e.g. fields=name,portions
+#   ?format=ndjson  stream every remaining row from a server-side cursor
+ListFormat = Literal["json", "ndjson"]
 
 
-@app.get("/ingredients")
-def get_recipes(db: Session = Depends(get_db)):
-    return db.query(Ingredient).all()
+async def list_rows(db, model, fields, after, limit, format, filters=None, conditions=()):
+    if format == "ndjson":
+        return stream_ndjson(model, fields, after, limit, filters, conditions)
+    return await list_page(db, model, fields, after, limit, filters, conditions)
 
 
-@app.get("/instructions")
-def get_recipes(db: Session = Depends(get_db)):
-    return db.query(Instruction).all()
+async def fits_diets(db, diets):
+    # recipes whose exclusion mask shares no bit with the requested diets
+    exclude = await diet_mask(db, diets)
+    if not exclude:
+        return ()
+    compatible = select(RecipeExclusion.recipe).where(RecipeExclusion.mask.op("&")(exclude) == 0)
+    return (Recipe.name.in_(compatible),)
+
+
+# ?include=ingredients,nutrients returns RecipeDetail pages instead (see
+# recipes.py), priced and scaled to ?portions (default: each recipe's own)
+@app.get("/recipes", response_model=Union[List[schemas.Recipe], List[RecipeDetail]])
+async def get_recipes(
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: ListFormat = "json",
+    diets: List[str] = Query([]),
+    include: Optional[str] = None,
+    portions: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db),
+):
+    conditions = await fits_diets(db, diets)
+    if include is None:
+        return await list_rows(db, Recipe, fields, after, limit, format, conditions=conditions)
+    if fields or format != "json":
+        raise HTTPException(status_code=400, detail="include does not combine with fields or format")
+    return await recipe_details_page(db, parse_include(include), portions, after, limit, conditions)
 
 
-@app.get("/nutrients")
-def get_recipes(db: Session = Depends(get_db)):
-    return db.query(Nutrient).all()
+@app.get("/ingredients", response_model=List[schemas.Ingredient])
+async def get_ingredients(
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: ListFormat = "json",
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await list_rows(db, Ingredient, fields, after, limit, format)
+
+
+@app.get("/instructions", response_model=List[schemas.Instruction])
+async def get_instructions(
+    recipe: Optional[str] = None,
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: ListFormat = "json",
+    db: AsyncSession = Depends(get_async_db),
+):
+    # filtering on the leading primary key column keeps this an index range scan
+    return await list_rows(db, Instruction, fields, after, limit, format, {"recipe": recipe})
+
+
+@app.get("/nutrients", response_model=List[schemas.Nutrient])
+async def get_nutrients(
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: ListFormat = "json",
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await list_rows(db, Nutrient, fields, after, limit, format)
+
+NutritionOrder = Literal["recipe", "kcal", "fat", "carbohydrates", "sugar", "protein", "salt"]
+
 
-"""
 @app.get("/recipes/nutrition")
-def get_nutrition_report(db: Session = Depends(get_db)):
-    # You can even use filters or order_by on the view!
-    results = db.query(RecipeNutritionView).order_by(RecipeNutritionView.recipe_name.asc()).all()
-    return results
-"""
+async def get_nutrition_report(
+    min_kcal: Optional[float] = None,
+    max_kcal: Optional[float] = None,
+    min_fat: Optional[float] = None,
+    max_fat: Optional[float] = None,
+    min_carbohydrates: Optional[float] = None,
+    max_carbohydrates: Optional[float] = None,
+    min_sugar: Optional[float] = None,
+    max_sugar: Optional[float] = None,
+    min_protein: Optional[float] = None,
+    max_protein: Optional[float] = None,
+    min_salt: Optional[float] = None,
+    max_salt: Optional[float] = None,
+    order_by: NutritionOrder = "recipe",
+    descending: bool = False,
+    limit: Optional[int] = Query(None, ge=1),
+    diets: List[str] = Query([]),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Values are per portion and read from the materialized recipe_nutrition
+    # table, so filters and ordering run on its indexed columns
+    bounds = {
+        "min_kcal": min_kcal, "max_kcal": max_kcal,
+        "min_fat": min_fat, "max_fat": max_fat,
+        "min_carbohydrates": min_carbohydrates, "max_carbohydrates": max_carbohydrates,
+        "min_sugar": min_sugar, "max_sugar": max_sugar,
+        "min_protein": min_protein, "max_protein": max_protein,
+        "min_salt": min_salt, "max_salt": max_salt,
+    }
+    exclude = await diet_mask(db, diets)
+    return await nutrition_report(db, bounds, order_by, descending, limit, exclude)
+
+
+# Declared after /recipes/nutrition, which would match {name} otherwise
+@app.get("/recipes/{name:path}", response_model=RecipeDetail)
+async def get_recipe(
+    name: str,
+    portions: Optional[float] = Query(None, gt=0),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # the recipe, its ingredients and their nutrient groups in two queries
+    return await recipe_detail(db, name, portions)
+
+
+@app.get("/shopping-list", response_model=ShoppingList)
+async def get_shopping_list(start_date: date, end_date: date, db: AsyncSession = Depends(get_async_db)):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    return await shopping_list(db, start_date, end_date)
+
+
+@app.post("/menu-plan/generate", response_model=MenuPlanProposal)
+async def generate_menu_plan(request: PlanRequest):
+    # uses expiring stock first and buys as little as possible; see planner.py
+    return await run_in_threadpool(generate_plan, request, data_version())
+
+
+def generate_plan(request: PlanRequest, version: int):
+    with SessionLocal() as db:
+        result = plan_menu(db, request, version)
+        if request.save:
+            db.commit()
+        return result
+
+
+# Menu plan history over a date range, archived weeks included; see history.py
+@app.get("/menu-plan/analytics/weekly-cost", response_model=List[WeeklyCost])
+async def get_weekly_cost(start_date: date, end_date: date, db: AsyncSession = Depends(get_async_db)):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    return await weekly_cost(db, start_date, end_date)
+
+
+@app.get("/menu-plan/analytics/top-recipes", response_model=List[RecipeFrequency])
+async def get_top_recipes(
+    start_date: date,
+    end_date: date,
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    return await top_recipes(db, start_date, end_date, limit)
+
+
+@app.get("/menu-plan/analytics/ingredients", response_model=List[IngredientConsumption])
+async def get_ingredient_consumption(
+    start_date: date,
+    end_date: date,
+    bucket: Literal["week", "month"] = "week",
+    ingredients: List[str] = Query([]),
+    # the ingredients costing the most over the range
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    return await ingredient_consumption(db, start_date, end_date, bucket, ingredients, limit)
+
+
+SearchKind = Literal["all", "recipe", "ingredient"]
+
+
+@app.get("/search", response_model=List[SearchResult])
+async def search(
+    q: Optional[str] = None,
+    ingredients: List[str] = Query([]),
+    kind: SearchKind = "all",
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+):
+    # q: words matched, accent-insensitively, against recipe names, descriptions,
+    #    ingredients and preparations and against ingredient names
+    # ingredients: only recipes using all of these (each may match several)
+    if not (q and q.strip()) and not ingredients:
+        raise HTTPException(status_code=400, detail="Give q or ingredients")
+    return await run_in_threadpool(search_recipes, q, ingredients, kind, limit)
+
+
+def search_recipes(q, ingredients, kind, limit):
+    with SessionLocal() as db:
+        return search_index.search(db, q, ingredients, kind, limit)
+
+
+async def change_stock(db: AsyncSession, mode: str, request: StockRequest):
+    if (request.recipe is None) == (request.day is None):
+        raise HTTPException(status_code=400, detail="Give either a recipe or a day")
+    if request.day is not None and request.portions is not None:
+        raise HTTPException(status_code=400, detail="portions only apply to a recipe")
+    expected = [e.model_dump() for e in request.expected_versions]
+    result = await consume_stock(db, mode, request.recipe, request.day, request.portions, expected)
+    await db.commit()
+    # the notification follows; this caller's next read already sees its write
+    data_versions.bump("suggestions")
+    return result
+
+
+# Cooking takes what is on stock and reports the shortages. A checked consume
+# takes everything or nothing (409 with the shortages); it is not a
+# reservation, nothing is set aside to be taken later.
+@app.post("/stock/cook", response_model=StockChange)
+async def cook(request: StockRequest, db: AsyncSession = Depends(get_async_db)):
+    return await change_stock(db, "cook", request)
+
+
+@app.post("/stock/consume", response_model=StockChange)
+async def consume(request: StockRequest, db: AsyncSession = Depends(get_async_db)):
+    return await change_stock(db, "consume", request)
+
+
+# "engine" answers from the in-memory suggestion engine, "sql" runs the aggregate below
+SUGGESTION_BACKEND = os.getenv("SUGGESTION_BACKEND", "engine")
+
+
+# Rows are encoded as computed, without a validation pass (serialization.py)
+suggestions_encoder = json_encoder(RecipeAvailability)
+batch_encoder = json_encoder(ScenarioSuggestions)
+
+
+def diets_key(diets):
+    return tuple(sorted(set(diets)))
+
+
+async def cached_json(http_request: Request, key, produce):
+    """
+    Serve the JSON body produce() encodes from suggestion_cache, with an ETag
+    derived from the key. Answers only change with the data version (bumped
+    by triggers on every write) and the date (the SQL uses CURRENT_DATE), so
+    callers put both in the key.
+    """
+    etag = suggestion_cache.etag(key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in if_none_match(http_request):
+        return Response(status_code=304, headers=headers)
+
+    body = suggestion_cache.get(key)
+    if body is None:
+        body = await produce()
+        suggestion_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.post("/recipes/suggestions", response_model=List[RecipeAvailability])
-def calculate_recipe_costs(
+async def calculate_recipe_costs(
     request: SuggestionRequest, 
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    sql = text("""
-        SELECT 
-            i.recipe AS recipe,
-            COUNT(*)                                                                        AS nbr_of_ingredients,
-            SUM(
-                CASE 
-                    WHEN    (quantity * (:portions/ r.portions) ) > quantity_on_stock 
-                            OR  CURRENT_DATE > expiration_date::date  
-                    THEN 1 
-                    ELSE 0 
-                END
-            )                                                                               AS missing_ingredients,
+    version = data_version()
+    key = (
+        SUGGESTION_BACKEND, request.portions, request.scope, diets_key(request.diets),
+        version, date.today().isoformat(),
+    )
+
+    async def produce():
+        rows = await compute_suggestions(db, request, version)
+        return encode(suggestions_encoder, rows)
+
+    return await cached_json(http_request, key, produce)
+
+
+@app.post("/recipes/suggestions/batch", response_model=List[ScenarioSuggestions])
+async def calculate_recipe_costs_batch(
+    batch: SuggestionBatchRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db),
+):
+    # The engine evaluates all scenarios on one snapshot and shares the work
+    # between scenarios with the same portions or scope (see suggestions.py)
+    version = data_version()
+    key = (
+        "batch", SUGGESTION_BACKEND,
+        tuple((r.portions, r.scope, diets_key(r.diets)) for r in batch.scenarios),
+        None if batch.recipes is None else tuple(sorted(set(batch.recipes))), batch.limit,
+        version, date.today().isoformat(),
+    )
+
+    async def produce():
+        results = await compute_suggestion_batch(db, batch, version)
+        return encode(batch_encoder, results)
+
+    return await cached_json(http_request, key, produce)
+
+
+async def compute_suggestions(db: AsyncSession, request: SuggestionRequest, version: int):
+    if SUGGESTION_BACKEND == "sql":
+        return await calculate_recipe_costs_sql(request, db)
+    return await run_in_threadpool(engine_suggestions, request, version)
+
+
+def engine_suggestions(request: SuggestionRequest, version: int):
+    with SessionLocal() as db:
+        return suggestion_engine.suggest(request, db, version=version)
+
+
+async def compute_suggestion_batch(db: AsyncSession, batch: SuggestionBatchRequest, version: int):
+    if SUGGESTION_BACKEND == "sql":
+        # reference path: one aggregate per scenario
+        results = [await calculate_recipe_costs_sql(request, db) for request in batch.scenarios]
+        if batch.recipes is not None:
+            keep = set(batch.recipes)
+            results = [[row for row in rows if row["recipe"] in keep] for rows in results]
+        results = [rows[:batch.limit] for rows in results]
+    else:
+        results = await run_in_threadpool(engine_suggestion_batch, batch, version)
+    return [
+        {"scenario": k, "request": request.model_dump(), "suggestions": rows}
+        for k, (request, rows) in enumerate(zip(batch.scenarios, results))
+    ]
+
+
+def engine_suggestion_batch(batch: SuggestionBatchRequest, version: int):
+    with SessionLocal() as db:
+        return suggestion_engine.suggest_batch(batch.scenarios, db, batch.recipes, batch.limit, version=version)
+
+
+def if_none_match(http_request: Request):
+    header = http_request.headers.get("if-none-match", "")
+    return {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    # hit/miss/eviction counters to size SUGGESTION_CACHE_SIZE / SUGGESTION_CACHE_TTL
+    return {"suggestions": suggestion_cache.stats()}
+
+
+# Prometheus text exposition: per-route latency, SQL statements, rows and
+# encoding time per request, pool checkouts and waits
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED)")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Samples collected since start (or the last reset) when PROFILE_SAMPLE_MS is
+# set, in collapsed stack format for flamegraph.pl or speedscope
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def get_profile(reset: bool = False):
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (PROFILE_SAMPLE_MS)")
+    return PlainTextResponse(profiler.collapsed(reset))
+
+
+# days_to_expiry comes from v_instructions, computed once per row. ":exclude = 0"
+# folds away without diets, so the planner does not guess a selectivity for the mask test.
+# Stock is pooled in grams over every unit of an ingredient (see units.py):
+# recipe_grams is what the recipe needs of the row's ingredient over all its
+# units, compared with the pooled stock that has not expired (missing) and
+# that expires after today (offsets the cost, in proportion to each row).
+# asyncpg types :portions from its context (an integer column) unless cast.
+SUGGESTIONS_SQL = text("""
+    WITH pools AS (
+        SELECT
+            name,
+            SUM(CASE WHEN expiration_date IS NULL OR expiration_date >= CURRENT_DATE THEN stock_in_grams ELSE 0 END) AS usable_grams,
+            SUM(CASE WHEN expiration_date > CURRENT_DATE THEN stock_in_grams ELSE 0 END)                             AS restockable_grams
+        FROM ingredients
+        GROUP BY name
+    )
+    SELECT 
+        i.recipe AS recipe,
+        COUNT(*)                                                                        AS nbr_of_ingredients,
+        SUM(
+            CASE 
+                WHEN    i.recipe_grams * (CAST(:portions AS double precision) / r.portions) > p.usable_grams
+                THEN 1 
+                ELSE 0 
+            END
+        )                                                                               AS missing_ingredients,
+        SUM(
+            CASE 
+                WHEN    days_to_expiry < :scope 
+                        AND days_to_expiry >= 0 
+                THEN 1 
+                ELSE 0 
+            END
+        )                                                                               AS "expiring_within_scope", 
+        string_agg(
+            CASE 
+                WHEN days_to_expiry < :scope AND days_to_expiry >= 0 
+                THEN CONCAT(i.ingredient, ' (', i.expiration_date, ') ')
+                ELSE ''
+            END, '' ORDER BY i.ingredient, i.unit
+        )                                                                               AS "expiring_ingredients",
+        ROUND(SUM(price_per_unit * quantity / r.portions)::numeric, 2)                  AS price_per_portion,
+        ROUND(SUM(price_per_unit * quantity * (CAST(:portions AS double precision) / r.portions) )::numeric, 2)    AS price,
+        ROUND( 
             SUM(
-                CASE 
-                    WHEN    expiration_date::date - CURRENT_DATE < :scope 
-                            AND expiration_date::date - CURRENT_DATE >= 0 
-                    THEN 1 
-                    ELSE 0 
+                price_per_unit * quantity * (CAST(:portions AS double precision) / r.portions)
+                - CASE
+                    WHEN    i.recipe_grams * (CAST(:portions AS double precision) / r.portions) > p.restockable_grams
+                    THEN    p.restockable_grams * (price_per_unit * quantity / i.recipe_grams)
+                    ELSE    0
                 END
-            )                                                                               AS "expiring_within_scope", 
-            string_agg(
-                CASE 
-                    WHEN expiration_date::date - CURRENT_DATE < :scope AND expiration_date::date - CURRENT_DATE >= 0 
-                    THEN CONCAT(i.ingredient, ' (', i.expiration_date, ') ')
-                    ELSE ''
-                END, ''
-            )                                                                               AS "expiring_ingredients",
-            ROUND(SUM(price_per_unit * quantity / r.portions)::numeric, 2)                  AS price_per_portion,
-            ROUND(SUM(price_per_unit * quantity * (:portions/ r.portions) )::numeric, 2)    AS price,
-            ROUND( 
-                SUM(
-                    CASE 
-                        WHEN    (quantity * (:portions/ r.portions) ) > quantity_on_stock  
-                                AND expiration_date::date > CURRENT_DATE
-                        THEN ((quantity * (:portions / r.portions) ) - quantity_on_stock) * price_per_unit 
-                        ELSE  quantity * (:portions / r.portions) * price_per_unit
-                    END
-                )::numeric, 2
-            )                                                                               AS cost
-        FROM recipes r 
-        JOIN v_instructions i ON r.name = i.recipe
-        GROUP BY i.recipe
-        ORDER BY  "expiring_within_scope" desc;
-    """)
-    
+            )::numeric, 2
+        )                                                                               AS cost
+    FROM recipes r 
+    JOIN v_instructions i ON r.name = i.recipe
+    JOIN pools p ON p.name = i.ingredient
+    LEFT JOIN recipe_exclusions x ON x.recipe = r.name
+    WHERE (:exclude = 0 OR (COALESCE(x.mask, 0) & :exclude) = 0)
+    GROUP BY i.recipe
+    ORDER BY  "expiring_within_scope" desc, i.recipe;
+""")
+
+
+async def calculate_recipe_costs_sql(request: SuggestionRequest, db: AsyncSession):
     # execute with the parameter dictionary
-    result = db.execute(sql, {"portions": request.portions, "scope": request.scope})
-    
-    # transform rows into a list of dictionaries for Pydantic to parse
-    return [dict(row._mapping) for row in result]
\ No newline at end of file
+    exclude = await diet_mask(db, request.diets)
+    result = await db.execute(SUGGESTIONS_SQL, {"portions": request.portions, "scope": request.scope, "exclude": exclude})
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
\ No newline at end of file
@@ -0,0 +1,308 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.responses import JSONResponse
+
+
+# METRICS_ENABLED=false leaves the app uninstrumented (to measure the overhead)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with the route that issued them, 0 disables it
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# Interval of the stack sampler behind /debug/profile, 0 disables it
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 1000, 10_000, 100_000, 1_000_000)
+
+slow_query_log = logging.getLogger("app.slow_queries")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Histogram:
+    """Cumulative buckets per label values, rendered in Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # bucket counts, then +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                total += count
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (bound,))} {total}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {values[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {total}"
+
+
+class CounterMetric:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class GaugeCallback:
+    # read when scraped: callback() -> {label values: value}
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in sorted(self.callback().items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+ROUTE_LABELS = ("method", "route")
+
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Time from request to the last body byte, streaming included.",
+    ROUTE_LABELS + ("status",),
+)
+request_statements = Histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", ROUTE_LABELS, COUNT_BUCKETS,
+)
+request_sql_seconds = Histogram(
+    "http_request_sql_seconds", "Time spent executing SQL statements per request.", ROUTE_LABELS,
+)
+request_rows = Histogram(
+    "http_request_sql_rows", "Rows returned or affected by the SQL statements of a request, as the driver reports them.",
+    ROUTE_LABELS, COUNT_BUCKETS,
+)
+request_serialize_seconds = Histogram(
+    "http_request_serialize_seconds", "Time spent encoding response bodies per request.", ROUTE_LABELS,
+)
+statements_total = CounterMetric("db_statements_total", "SQL statements executed.", ("engine",))
+statement_seconds_total = CounterMetric("db_statement_seconds_total", "Time spent executing SQL statements.", ("engine",))
+slow_statements_total = CounterMetric("db_slow_statements_total", "Statements slower than SLOW_QUERY_MS.", ("engine",))
+pool_checkouts_total = CounterMetric("db_pool_checkouts_total", "Connections checked out of the pool.", ("engine",))
+pool_wait_seconds = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool, connecting and pre-ping included.",
+    ("engine",),
+)
+
+_pools = {}
+
+
+def _pool_state():
+    state = {}
+    for name, pool in _pools.items():
+        # only queue pools report these; SQLite's pools do not
+        for key in ("checkedout", "checkedin"):
+            if hasattr(pool, key):
+                state[(name, key)] = getattr(pool, key)()
+    return state
+
+
+REGISTRY = [
+    request_seconds, request_statements, request_sql_seconds, request_rows, request_serialize_seconds,
+    statements_total, statement_seconds_total, slow_statements_total, pool_checkouts_total, pool_wait_seconds,
+    GaugeCallback("db_pool_connections", "Pool connections by state, read when scraped.", ("engine", "state"), _pool_state),
+]
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class _RequestStats:
+    __slots__ = ("route", "statements", "sql_seconds", "rows", "serialize_seconds")
+
+    def __init__(self):
+        self.route = None
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.serialize_seconds = 0.0
+
+
+# Set by the middleware for the duration of a request. Statements awaited on
+# an AsyncSession see it: SQLAlchemy runs them in a greenlet sharing the
+# handler's context. So does the engine, index and planner work handed to
+# run_in_threadpool, which copies the context into the worker thread.
+_current = ContextVar("request_stats", default=None)
+
+
+def record_pool_checkout(engine_name, pool, seconds):
+    _pools[engine_name] = pool
+    pool_checkouts_total.inc((engine_name,))
+    pool_wait_seconds.observe((engine_name,), seconds)
+
+
+def record_statement(engine_name, statement, seconds, rowcount):
+    statements_total.inc((engine_name,))
+    statement_seconds_total.inc((engine_name,), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.sql_seconds += seconds
+        if rowcount > 0:
+            stats.rows += rowcount
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_statements_total.inc((engine_name,))
+        route = stats.route if stats is not None else None
+        slow_query_log.warning(
+            "slow statement %.1fms on %s (%s, %s rows): %s",
+            seconds * 1000, engine_name, route or "outside a request", rowcount, " ".join(statement.split())[:1000],
+        )
+
+
+@contextmanager
+def serializing():
+    """Count the time spent in the block as response encoding of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - start
+
+
+class InstrumentedJSONResponse(JSONResponse):
+    # the default response class, so FastAPI's own encoding is timed too
+    def render(self, content) -> bytes:
+        with serializing():
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no extra task, so the context it sets reaches the
+    handler, its awaited queries and its threadpool calls) recording per-route latency and what
+    record_statement() and serializing() collected during the request.
+    Routes are labelled with their path template; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = _RequestStats()
+        stats.route = scope["path"]
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "unmatched"))
+            request_seconds.observe(labels + (str(status),), elapsed)
+            request_statements.observe(labels, stats.statements)
+            request_sql_seconds.observe(labels, stats.sql_seconds)
+            request_rows.observe(labels, stats.rows)
+            request_serialize_seconds.observe(labels, stats.serialize_seconds)
+
+
+IDLE_FRAMES = ("select (selectors.py", "wait (threading.py")
+
+
+class StackSampler:
+    """
+    Sampling profiler: a daemon thread records the Python stack of every other
+    thread each `interval` seconds. Stacks are kept in the collapsed format
+    flamegraph.pl and speedscope read ("outer;inner;leaf count").
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # threads waiting for work (event loop selector, idle pool workers) are not busy
+                if stack and stack[0].startswith(IDLE_FRAMES):
+                    continue
+                with self._lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self, reset=False) -> str:
+        with self._lock:
+            samples = self.samples
+            if reset:
+                self.samples = Counter()
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+profiler = StackSampler(PROFILE_SAMPLE_MS / 1000) if PROFILE_SAMPLE_MS else None
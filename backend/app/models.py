@@ -1,4 +1,6 @@
-from sqlalchemy import String, Float, ForeignKey, Integer, ForeignKeyConstraint, Date
+from sqlalchemy import (
+    String, Float, ForeignKey, Integer, BigInteger, ForeignKeyConstraint, Date, Index, DDL, event, CheckConstraint, Computed,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 from datetime import datetime
@@ -14,6 +16,31 @@ class MenuPlan(Base):
     meal: Mapped[str] = mapped_column(String(200), ForeignKey("recipes.name", ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
     portions: Mapped[float] = mapped_column(Float)
 
+    __table_args__ = (
+        # SQLite has no partitions: a covering index serves the date range scans
+        Index("ix_menu_plan_date", "date", "meal", "portions").ddl_if(dialect="sqlite"),
+        # On PostgreSQL one partition per month (see history.py), so range
+        # scans and archiving only touch the months involved
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
+# Catches the rows of months without a partition yet; history.py moves them out
+event.listen(
+    MenuPlan.__table__,
+    "after_create",
+    DDL("CREATE TABLE menu_plan_default PARTITION OF menu_plan DEFAULT").execute_if(dialect="postgresql"),
+)
+
+# Archived menu plan history: one row per recipe and week (see history.py)
+class MenuPlanArchive(Base):
+    __tablename__ = "menu_plan_archive"
+    # Monday of the week
+    week: Mapped[datetime] = mapped_column(Date, primary_key=True)
+    meal: Mapped[str] = mapped_column(String(200), ForeignKey("recipes.name", ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    # planned meals and their portions summed over the week
+    times: Mapped[int] = mapped_column(Integer)
+    portions: Mapped[float] = mapped_column(Float)
+
 class Diet(Base):
     __tablename__ = "diets"
     diet: Mapped[str] = mapped_column(String(100), primary_key=True)
@@ -55,13 +82,22 @@ class Ingredient(Base):
     __tablename__ = "ingredients"
     name: Mapped[str] = mapped_column(String(100), primary_key=True)
     # Foreign Key to Nutrients
-    group: Mapped[str] = mapped_column(ForeignKey("nutrients.ingredient_group", ondelete='CASCADE', onupdate='CASCADE'))
+    # Indexed for the nutrients -> ingredients trigger lookups and FK cascades
+    group: Mapped[str] = mapped_column(ForeignKey("nutrients.ingredient_group", ondelete='CASCADE', onupdate='CASCADE'), index=True)
     unit: Mapped[str] = mapped_column(String(50), primary_key=True)
     g_per_unit : Mapped[float] = mapped_column(Float)
     price_per_unit : Mapped[float] = mapped_column(Float)
     store: Mapped[str] = mapped_column(String(50))
     quantity_on_stock : Mapped[float] = mapped_column(Float, nullable=False)
-    expiration_date: Mapped[datetime] = mapped_column(Date, nullable=True)   
+    # Canonical quantity: the units an ingredient is stocked in pool by name in grams (see units.py)
+    stock_in_grams: Mapped[float] = mapped_column(Float, Computed("quantity_on_stock * g_per_unit", persisted=True))
+    # Indexed for expiring-soon range scans
+    expiration_date: Mapped[datetime] = mapped_column(Date, nullable=True, index=True)
+    # Bumped by every stock change (see stock.py), for optimistic concurrency
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="1")
+
+    # Every unit converts to grams
+    __table_args__ = (CheckConstraint("g_per_unit > 0", name="ck_ingredients_g_per_unit"),)
     
     
     # Relationships
@@ -89,6 +125,10 @@ class Instruction(Base):
     
     quantity: Mapped[float] = mapped_column(Float)
     preparation: Mapped[str] = mapped_column(String(200), nullable=True)
+    # quantity * g_per_unit of the ingredient row, and the grams of the ingredient the
+    # recipe needs over all its units; kept current by the triggers in units.py
+    quantity_in_grams: Mapped[float] = mapped_column(Float, nullable=True)
+    recipe_grams: Mapped[float] = mapped_column(Float, nullable=True)
 
     # ...and define them as a single Constraint here:
     __table_args__ = (
@@ -96,11 +136,78 @@ class Instruction(Base):
             ["ingredient", "unit"],
             ["ingredients.name", "ingredients.unit"],
         ),
+        # The PK leads with recipe; ingredient -> recipes lookups (nutrition and
+        # exclusion triggers, FK cascades from ingredients) need their own index
+        Index("ix_instructions_ingredient_unit", "ingredient", "unit"),
     )
 
     # Relationships
     recipe_name: Mapped["Recipe"] = relationship(back_populates="ingredients_list")
     ingredient_name: Mapped["Ingredient"] = relationship(back_populates="used_in_recipes")
+
+
+
+##### MATERIALIZED MODELS #####
+# Maintained by the statement-level triggers installed in nutrition.py;
+# never written by the application itself.
+
+# Nutrients per unit of each ingredient (materialized v_ingredients_nutrition)
+class IngredientNutrition(Base):
+    __tablename__ = "ingredient_nutrition"
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    unit: Mapped[str] = mapped_column(String(50), primary_key=True)
+    group: Mapped[str] = mapped_column(String(100), index=True)
+    g_per_unit: Mapped[float] = mapped_column(Float)
+    price_per_unit: Mapped[float] = mapped_column(Float)
+
+    unit_kcal: Mapped[float] = mapped_column(Float)
+    unit_kj: Mapped[float] = mapped_column(Float)
+    g_per_unit_fat: Mapped[float] = mapped_column(Float)
+    g_per_unit_saturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    g_per_unit_mono_unsaturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    g_per_unit_polyunsaturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    unit_cholesterol_mg: Mapped[float] = mapped_column(Float)
+    g_per_unit_carbohydrates: Mapped[float] = mapped_column(Float)
+    g_per_unit_sugar: Mapped[float] = mapped_column(Float)
+    g_per_unit_starch: Mapped[float] = mapped_column(Float)
+    g_per_unit_dietary_fibre: Mapped[float] = mapped_column(Float)
+    g_per_unit_protein: Mapped[float] = mapped_column(Float)
+    g_per_unit_salt: Mapped[float] = mapped_column(Float)
+
+# Nutrients per portion of each recipe
+class RecipeNutrition(Base):
+    __tablename__ = "recipe_nutrition"
+    recipe: Mapped[str] = mapped_column(String(200), primary_key=True)
+    portions: Mapped[int] = mapped_column(Integer)
+    nbr_of_ingredients: Mapped[int] = mapped_column(Integer)
+
+    # Indexed columns are the ones /recipes/nutrition filters and sorts on
+    kcal: Mapped[float] = mapped_column(Float, index=True)
+    kj: Mapped[float] = mapped_column(Float)
+    fat: Mapped[float] = mapped_column(Float, index=True)
+    saturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    mono_unsaturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    polyunsaturated_fatty_acids: Mapped[float] = mapped_column(Float)
+    cholesterol_mg: Mapped[float] = mapped_column(Float)
+    carbohydrates: Mapped[float] = mapped_column(Float, index=True)
+    sugar: Mapped[float] = mapped_column(Float, index=True)
+    starch: Mapped[float] = mapped_column(Float)
+    dietary_fibre: Mapped[float] = mapped_column(Float)
+    protein: Mapped[float] = mapped_column(Float, index=True)
+    salt: Mapped[float] = mapped_column(Float, index=True)
+
+# Bit position of each problematic component in the exclusion masks.
+# Bits are handed out once and never reused, so stored masks stay valid.
+class ProblematicComponent(Base):
+    __tablename__ = "problematic_components"
+    component: Mapped[str] = mapped_column(String(100), primary_key=True)
+    bit: Mapped[int] = mapped_column(Integer, unique=True)
+
+# OR of the bits of every problematic component found in a recipe's ingredients
+class RecipeExclusion(Base):
+    __tablename__ = "recipe_exclusions"
+    recipe: Mapped[str] = mapped_column(ForeignKey("recipes.name", ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    mask: Mapped[int] = mapped_column(BigInteger)
     
     
     
@@ -0,0 +1,128 @@
+from typing import Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import RecipeNutrition, RecipeExclusion
+from .triggers import changed_rows_trigger
+
+
+# nutrients column -> ingredient_nutrition column
+NUTRIENT_COLUMNS = {
+    "kcal": "unit_kcal",
+    "kj": "unit_kj",
+    "fat": "g_per_unit_fat",
+    "saturated_fatty_acids": "g_per_unit_saturated_fatty_acids",
+    "mono_unsaturated_fatty_acids": "g_per_unit_mono_unsaturated_fatty_acids",
+    "polyunsaturated_fatty_acids": "g_per_unit_polyunsaturated_fatty_acids",
+    "cholesterol_mg": "unit_cholesterol_mg",
+    "carbohydrates": "g_per_unit_carbohydrates",
+    "sugar": "g_per_unit_sugar",
+    "starch": "g_per_unit_starch",
+    "dietary_fibre": "g_per_unit_dietary_fibre",
+    "protein": "g_per_unit_protein",
+    "salt": "g_per_unit_salt",
+}
+
+# Columns of recipe_nutrition with an index, usable in filters and ORDER BY
+INDEXED_COLUMNS = ["kcal", "fat", "carbohydrates", "sugar", "protein", "salt"]
+
+
+_REFRESH_INGREDIENTS = f"""
+CREATE OR REPLACE FUNCTION refresh_ingredient_nutrition(ingredient_names text[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM ingredient_nutrition WHERE name = ANY(ingredient_names);
+    INSERT INTO ingredient_nutrition (name, unit, "group", g_per_unit, price_per_unit, {", ".join(NUTRIENT_COLUMNS.values())})
+    SELECT
+        i.name, i.unit, i."group", i.g_per_unit, i.price_per_unit,
+        {", ".join(f"ROUND(((i.g_per_unit / 100) * n.{n})::numeric, 4)" for n in NUTRIENT_COLUMNS)}
+    FROM ingredients i
+    JOIN nutrients n ON i."group" = n.ingredient_group
+    WHERE i.name = ANY(ingredient_names);
+
+    PERFORM refresh_recipe_nutrition(ARRAY(
+        SELECT DISTINCT recipe FROM instructions WHERE ingredient = ANY(ingredient_names)
+    ));
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_REFRESH_RECIPES = f"""
+CREATE OR REPLACE FUNCTION refresh_recipe_nutrition(recipe_names text[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM recipe_nutrition WHERE recipe = ANY(recipe_names);
+    INSERT INTO recipe_nutrition (recipe, portions, nbr_of_ingredients, {", ".join(NUTRIENT_COLUMNS)})
+    SELECT
+        r.name, r.portions, COUNT(*),
+        {", ".join(f"ROUND((SUM(m.quantity * n.{c}) / NULLIF(r.portions, 0))::numeric, 2)" for c in NUTRIENT_COLUMNS.values())}
+    FROM recipes r
+    JOIN instructions m ON m.recipe = r.name
+    JOIN ingredient_nutrition n ON n.name = m.ingredient AND n.unit = m.unit
+    WHERE r.name = ANY(recipe_names)
+    GROUP BY r.name, r.portions;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def install_nutrition_triggers(connection):
+    """
+    Create the refresh functions and the triggers keeping ingredient_nutrition
+    and recipe_nutrition up to date, then fill both tables. PostgreSQL only.
+    """
+    statements = [_REFRESH_RECIPES, _REFRESH_INGREDIENTS]
+    statements += changed_rows_trigger(
+        "ingredients", "nutrition_refresh", "name", ["name", "unit", '"group"', "g_per_unit", "price_per_unit"],
+        ["PERFORM refresh_ingredient_nutrition(changed)"],
+    )
+    statements += changed_rows_trigger(
+        "nutrients", "nutrition_refresh", "ingredient_group", ["ingredient_group", *NUTRIENT_COLUMNS],
+        ['PERFORM refresh_ingredient_nutrition(ARRAY(SELECT name FROM ingredients WHERE "group" = ANY(changed)))'],
+    )
+    statements += changed_rows_trigger(
+        "instructions", "nutrition_refresh", "recipe", ["recipe", "ingredient", "unit", "quantity"],
+        ["PERFORM refresh_recipe_nutrition(changed)"],
+    )
+    statements += changed_rows_trigger(
+        "recipes", "nutrition_refresh", "name", ["name", "portions"],
+        ["PERFORM refresh_recipe_nutrition(changed)"],
+    )
+    for statement in statements:
+        connection.execute(text(statement))
+    refresh_all(connection)
+
+
+def refresh_all(connection):
+    # Refreshing every ingredient cascades to every recipe that has instructions
+    connection.execute(text("SELECT refresh_ingredient_nutrition(ARRAY(SELECT name FROM ingredients))"))
+
+
+async def nutrition_report(
+    db: AsyncSession,
+    bounds: dict,
+    order_by: str = "recipe",
+    descending: bool = False,
+    limit: Optional[int] = None,
+    exclude: int = 0,
+):
+    """
+    Read recipe_nutrition. `bounds` maps "min_<column>"/"max_<column>" of
+    INDEXED_COLUMNS to values; None values are ignored. Recipes whose
+    exclusion mask intersects `exclude` are left out.
+    """
+    table = RecipeNutrition.__table__
+    stmt = select(table)
+    if exclude:
+        stmt = stmt.join(RecipeExclusion, RecipeExclusion.recipe == table.c.recipe).where(
+            RecipeExclusion.mask.op("&")(exclude) == 0
+        )
+    for name, value in bounds.items():
+        if value is None:
+            continue
+        side, column = name.split("_", 1)
+        stmt = stmt.where(table.c[column] >= value if side == "min" else table.c[column] <= value)
+    order = table.c[order_by]
+    stmt = stmt.order_by(order.desc() if descending else order.asc(), table.c.recipe)
+    if limit:
+        stmt = stmt.limit(limit)
+    return (await db.execute(stmt)).mappings().all()
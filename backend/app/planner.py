@@ -0,0 +1,270 @@
+import bisect
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .diets import combine_masks
+from .history import ensure_partitions
+from .schemas import PlanRequest
+from .suggestions import suggestion_engine
+
+
+# Stock left to expire inside the horizon counts this much of its value on
+# top of what has to be bought, so expiring stock is used first
+WASTE_WEIGHT = 1.0
+# Local search stops after this many rounds or seconds at the latest
+MAX_ROUNDS = 20
+TIME_BUDGET = 3.0
+EPSILON = 1e-9
+
+
+def _segments(counts):
+    return np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+
+
+class _Plan:
+    """
+    A menu of recipes over dated slots and the aggregates its cost depends
+    on, in grams pooled over the units of an ingredient (see units.py): T,
+    everything the menu needs of each ingredient, and B, per stock row, what
+    is needed of its ingredient on or before the row's expiration date. Like
+    in the shopping list, min(T, sum of min(stock, B) over the rows) comes
+    from stock and the rest is bought in the unit cheapest per gram.
+    """
+
+    def __init__(self, a, slot_dates, portions, end):
+        self.a = a
+        self.slot_dates = slot_dates
+        self.recipes = [-1] * len(slot_dates)
+        self.used = np.zeros(len(a.recipes), dtype=bool)
+        n_names = a.ing_name.max(initial=-1) + 1
+
+        # one need per recipe and ingredient: rows are sorted by ingredient
+        # within a recipe and recipe_grams already sums over its units
+        first = np.ones(len(a.row_recipe), dtype=bool)
+        first[1:] = (a.row_recipe[1:] != a.row_recipe[:-1]) | (a.row_name[1:] != a.row_name[:-1])
+        need_recipe = a.row_recipe[first]
+        self.need_name = a.row_name[first]
+        # grams for one meal of the requested portions
+        self.need = a.row_grams[first] * (portions / a.portions)[need_recipe]
+        self.counts = np.bincount(need_recipe, minlength=len(a.recipes))
+        self.starts = _segments(self.counts)
+
+        # every stock row of the ingredient of each need, as (need, row) pairs
+        by_name = np.argsort(a.ing_name, kind="stable")
+        name_counts = np.bincount(a.ing_name, minlength=n_names)
+        per_need = name_counts[self.need_name]
+        self.pair_need = np.repeat(np.arange(len(self.need)), per_need)
+        first_pairs = _segments(per_need)
+        within = np.arange(len(self.pair_need)) - np.repeat(first_pairs, per_need)
+        self.pair_row = by_name[np.repeat(_segments(name_counts)[self.need_name], per_need) + within]
+        self.pair_counts = np.add.reduceat(per_need, self.starts)
+        self.pair_starts = _segments(self.pair_counts)
+
+        # the first pair of every need, then the other rows of the
+        # ingredients stocked in several units and the needs they pool into
+        self.first_pairs = first_pairs
+        self.extra_pairs = np.flatnonzero(within > 0)
+        self.extra_needs = self.pair_need[self.extra_pairs]
+        self.pooled_needs = np.flatnonzero(per_need > 1)
+
+        self.stock = np.maximum(a.stock_g, 0)
+        self.price = a.price_per_g
+        # what is bought comes in the unit cheapest per gram
+        self.buy_price = np.full(n_names, np.inf)
+        np.minimum.at(self.buy_price, a.ing_name, a.price_per_g)
+        # stock that expires by the end of the horizon is wasted if unused
+        self.waste_price = WASTE_WEIGHT * (a.expiry <= end) * a.price_per_g
+        self.total = np.zeros(n_names)
+        self.before_expiry = np.zeros(len(a.stock_g))
+        # per ingredient, the sum of min(stock, B) over its rows
+        self.claimed = np.zeros(n_names)
+
+        # constant gathers of marginal()
+        self.pair_expiry = a.expiry[self.pair_row]
+        self.pair_grams = self.need[self.pair_need]
+        self.pair_waste_price = self.waste_price[self.pair_row]
+        self.need_buy_price = self.buy_price[self.need_name]
+
+    def needs(self, r):
+        start = self.starts[r]
+        return slice(start, start + self.counts[r])
+
+    def pairs(self, r):
+        start = self.pair_starts[r]
+        return slice(start, start + self.pair_counts[r])
+
+    def place(self, slot, r, sign=1):
+        needs, pairs = self.needs(r), self.pairs(r)
+        rows = self.pair_row[pairs]
+        # a recipe has one need per ingredient, so the fancy updates don't collide
+        self.total[self.need_name[needs]] += sign * self.need[needs]
+        claimed = np.minimum(self.stock[rows], self.before_expiry[rows])
+        self.before_expiry[rows] += sign * self.pair_grams[pairs] * (self.slot_dates[slot] <= self.pair_expiry[pairs])
+        # rows of one ingredient do collide here
+        np.add.at(self.claimed, self.a.ing_name[rows], np.minimum(self.stock[rows], self.before_expiry[rows]) - claimed)
+        self.recipes[slot] = r if sign > 0 else -1
+        self.used[r] = sign > 0
+
+    def marginal(self, day):
+        """What adding each recipe on `day` would add to the objective."""
+        row = self.pair_row
+        usable = np.where(day <= self.pair_expiry, self.pair_grams, 0)
+        covered = np.clip((self.stock - self.before_expiry)[row], 0, usable)
+        saved = self.pair_waste_price * covered
+        if len(self.extra_pairs):
+            pooled, extra = self.pooled_needs, self.extra_pairs
+            extra_covered, extra_saved = covered[extra], saved[extra]
+            covered, saved = covered[self.first_pairs], saved[self.first_pairs]
+            np.add.at(covered, self.extra_needs, extra_covered)
+            np.add.at(saved, self.extra_needs, extra_saved)
+            # with one row per ingredient claimed <= B <= total, so the cap
+            # min(total, claimed) only binds on the pooled needs
+            gap = (self.total - self.claimed)[self.need_name[pooled]]
+            covered[pooled] = np.minimum(self.need[pooled] + np.maximum(gap, 0), covered[pooled] + np.maximum(-gap, 0))
+        delta = self.need_buy_price * (self.need - covered) - saved
+        return np.add.reduceat(delta, self.starts)
+
+    def contribution(self, names, rows):
+        from_stock = np.minimum(self.total[names], self.claimed[names])
+        bought = self.buy_price[names] * (self.total[names] - from_stock)
+        wasted = self.waste_price[rows] * (self.stock[rows] - np.minimum(self.stock[rows], self.before_expiry[rows]))
+        return bought.sum() + wasted.sum()
+
+    def summary(self):
+        from_stock = np.minimum(self.total, self.claimed)
+        left = self.stock - np.minimum(self.stock, self.before_expiry)
+        needed = self.total > 0
+        return {
+            "purchase_cost": round(float((self.buy_price * (self.total - from_stock))[needed].sum()), 2),
+            "stock_used_value": round(float((self.buy_price * from_stock)[needed].sum()), 2),
+            "wasted_value": round(float((self.price * left)[self.waste_price > 0].sum()), 2),
+        }
+
+
+def _greedy(plan, allowed):
+    # fill the slots in date order with the cheapest recipe not used yet
+    for slot, day in enumerate(plan.slot_dates):
+        cost = np.where(allowed & ~plan.used, plan.marginal(day), np.inf)
+        plan.place(slot, int(np.argmin(cost)))
+
+
+def _replace_pass(plan, allowed, deadline):
+    moves = 0
+    for slot, day in enumerate(plan.slot_dates):
+        if time.perf_counter() > deadline:
+            break
+        current = plan.recipes[slot]
+        plan.place(slot, current, sign=-1)
+        cost = np.where(allowed & ~plan.used, plan.marginal(day), np.inf)
+        best = int(np.argmin(cost))
+        if cost[best] < cost[current] - EPSILON:
+            current = best
+            moves += 1
+        plan.place(slot, current)
+    return moves
+
+
+def _swap_pass(plan, deadline):
+    # Exchanging the days of two meals only matters when one of their
+    # ingredients expires in between; the others are skipped with a bisect
+    moves = 0
+    expiries = {}
+
+    def crosses(r, first, last):
+        if r not in expiries:
+            expiries[r] = sorted(plan.a.expiry[plan.pair_row[plan.pairs(r)]].tolist())
+        i = bisect.bisect_left(expiries[r], first)
+        return i < len(expiries[r]) and expiries[r][i] < last
+
+    days = plan.slot_dates.tolist()
+    for s1 in range(len(days)):
+        if time.perf_counter() > deadline:
+            break
+        for s2 in range(s1 + 1, len(days)):
+            first, last = min(days[s1], days[s2]), max(days[s1], days[s2])
+            r1, r2 = plan.recipes[s1], plan.recipes[s2]
+            if first == last or not (crosses(r1, first, last) or crosses(r2, first, last)):
+                continue
+            names = np.union1d(plan.need_name[plan.needs(r1)], plan.need_name[plan.needs(r2)])
+            rows = np.union1d(plan.pair_row[plan.pairs(r1)], plan.pair_row[plan.pairs(r2)])
+            before = plan.contribution(names, rows)
+            plan.place(s1, r1, sign=-1)
+            plan.place(s2, r2, sign=-1)
+            plan.place(s1, r2)
+            plan.place(s2, r1)
+            if plan.contribution(names, rows) < before - EPSILON:
+                moves += 1
+                continue
+            plan.place(s1, r2, sign=-1)
+            plan.place(s2, r1, sign=-1)
+            plan.place(s1, r1)
+            plan.place(s2, r2)
+    return moves
+
+
+def plan_menu(db: Session, request: PlanRequest, version: int):
+    """
+    Choose distinct recipes for `meals_per_day` meals over `days` days from
+    start_date, minimizing what has to be bought plus the value of stock
+    left to expire within the horizon, among the recipes compatible with
+    the diets.
+
+    Greedy construction in date order, then local search until no move
+    improves the objective (or MAX_ROUNDS / TIME_BUDGET run out): replacing
+    the recipe of a slot by the best unused one, and swapping the days of
+    two meals. Every candidate evaluation is a vectorized pass over the
+    recipe x ingredient rows of the suggestion engine snapshot.
+
+    With request.save the plan replaces menu_plan over the horizon; the
+    caller commits.
+    """
+    a = suggestion_engine.arrays(db, version)
+    start = request.start_date or date.today()
+    end = start + timedelta(days=request.days - 1)
+    slot_dates = np.repeat(np.arange(start.toordinal(), end.toordinal() + 1), request.meals_per_day)
+
+    exclude = combine_masks(a.diet_masks, request.diets)
+    allowed = (a.masks & exclude) == 0
+    if allowed.sum() < len(slot_dates):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{len(slot_dates)} meals need as many distinct recipes, only {int(allowed.sum())} fit the diets",
+        )
+
+    deadline = time.perf_counter() + TIME_BUDGET
+    plan = _Plan(a, slot_dates, request.portions, end.toordinal())
+    _greedy(plan, allowed)
+    greedy = plan.summary()
+    rounds = moves = 0
+    while rounds < MAX_ROUNDS and time.perf_counter() < deadline:
+        rounds += 1
+        improved = _replace_pass(plan, allowed, deadline) + _swap_pass(plan, deadline)
+        moves += improved
+        if not improved:
+            break
+
+    meals = [
+        {"date": date.fromordinal(int(day)), "meal": a.recipes[r], "portions": request.portions}
+        for day, r in zip(slot_dates.tolist(), plan.recipes)
+    ]
+    if request.save:
+        ensure_partitions(db, start, end)
+        db.execute(text("DELETE FROM menu_plan WHERE date BETWEEN :start AND :end"), {"start": start, "end": end})
+        db.execute(text("INSERT INTO menu_plan (date, meal, portions) VALUES (:date, :meal, :portions)"), meals)
+
+    return {
+        "start_date": start,
+        "end_date": end,
+        "meals": meals,
+        **plan.summary(),
+        "greedy_purchase_cost": greedy["purchase_cost"],
+        "greedy_wasted_value": greedy["wasted_value"],
+        "rounds": rounds,
+        "moves": moves,
+        "saved": request.save,
+    }
@@ -0,0 +1,116 @@
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import inspect, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from .listing import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+from .models import Ingredient, Instruction, Recipe
+from .nutrition import NUTRIENT_COLUMNS
+from .schemas import RecipeDetail
+from .serialization import json_encoder, json_response
+
+
+INCLUDES = ("ingredients", "nutrients")
+# selectinload fetches the instructions of up to 500 recipes per IN query;
+# a page (plus its look-ahead row) within that always costs the same two queries
+MAX_DETAIL_PAGE_SIZE = 250
+
+detail_encoder = json_encoder(RecipeDetail, many=False)
+details_encoder = json_encoder(RecipeDetail)
+
+
+def parse_include(include: Optional[str]) -> set:
+    names = {n.strip() for n in (include or "").split(",") if n.strip()}
+    unknown = names - set(INCLUDES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    return names
+
+
+def _graph(nutrients: bool):
+    # recipe -> instructions (one IN query per 500 recipes) -> ingredient
+    # [-> nutrient group], the last hops joined into the instruction query
+    ingredients = selectinload(Recipe.ingredients_list).joinedload(Instruction.ingredient_name, innerjoin=True)
+    if nutrients:
+        return ingredients.joinedload(Ingredient.nutrient_info, innerjoin=True)
+    return ingredients
+
+
+def _detail(recipe: Recipe, portions: Optional[float], include: set) -> dict:
+    # a recipe stored with 0 portions cannot be scaled; show it as written
+    scale = portions / recipe.portions if portions and recipe.portions else 1.0
+    portions = portions or recipe.portions
+    lines = sorted(recipe.ingredients_list, key=lambda m: (m.ingredient, m.unit))
+    price = sum(m.ingredient_name.price_per_unit * m.quantity * scale for m in lines)
+    detail = {
+        "name": recipe.name,
+        "description": recipe.description,
+        "portions": portions,
+        "recipe_portions": recipe.portions,
+        "price": round(price, 2),
+        "price_per_portion": round(price / portions, 2) if portions else 0.0,
+        "ingredients": None,
+        "nutrition": None,
+    }
+    if "ingredients" in include:
+        detail["ingredients"] = [
+            {
+                "ingredient": m.ingredient,
+                "unit": m.unit,
+                "group": m.ingredient_name.group,
+                "quantity": m.quantity * scale,
+                "preparation": m.preparation,
+                "price_per_unit": m.ingredient_name.price_per_unit,
+                "price": round(m.ingredient_name.price_per_unit * m.quantity * scale, 2),
+                "quantity_on_stock": m.ingredient_name.quantity_on_stock,
+                "expiration_date": m.ingredient_name.expiration_date,
+            }
+            for m in lines
+        ]
+    if "nutrients" in include:
+        # nutrients are given per 100 g, ingredient quantities in units of g_per_unit grams
+        grams = [(m.ingredient_name, m.quantity * scale * m.ingredient_name.g_per_unit / 100) for m in lines]
+        detail["nutrition"] = {
+            column: round(sum(getattr(i.nutrient_info, column) * g for i, g in grams), 2)
+            for column in NUTRIENT_COLUMNS
+        }
+    return detail
+
+
+async def recipe_detail(db: AsyncSession, name: str, portions: Optional[float] = None):
+    """One recipe with its ingredients and nutrition totals for `portions`, in two queries."""
+    result = await db.execute(select(Recipe).where(Recipe.name == name).options(_graph(nutrients=True)))
+    recipe = result.scalar_one_or_none()
+    if recipe is None:
+        raise HTTPException(status_code=404, detail=f"Recipe {name} not found")
+    return json_response(detail_encoder, _detail(recipe, portions, set(INCLUDES)))
+
+
+async def recipe_details_page(
+    db: AsyncSession,
+    include: set,
+    portions: Optional[float] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    conditions=(),
+):
+    """
+    A keyset page of recipes like list_page, each with its price and, as
+    included, ingredients and nutrition totals. The number of queries does
+    not depend on the page size.
+    """
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_DETAIL_PAGE_SIZE)
+    pk = list(inspect(Recipe).primary_key)
+    stmt = select(Recipe).order_by(*pk).options(_graph("nutrients" in include))
+    for condition in conditions:
+        stmt = stmt.where(condition)
+    if after:
+        stmt = stmt.where(tuple_(*pk) > tuple_(*decode_cursor(after, pk)))
+    recipes: List[Recipe] = (await db.execute(stmt.limit(limit + 1))).scalars().all()
+    headers = {}
+    if len(recipes) > limit:
+        recipes = recipes[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([recipes[-1].name])
+    return json_response(details_encoder, [_detail(r, portions, include) for r in recipes], headers)
@@ -1,8 +1,105 @@
-from pydantic import BaseModel
+from datetime import date
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+# Rows of the list endpoints, one field per column. ?fields= projections
+# return a subset of them; listing.py encodes straight from these types.
+class Recipe(BaseModel):
+    name: str
+    description: str
+    portions: int
+
+class Ingredient(BaseModel):
+    name: str
+    group: str
+    unit: str
+    g_per_unit: float
+    price_per_unit: float
+    store: str
+    quantity_on_stock: float
+    stock_in_grams: float
+    expiration_date: Optional[date] = None
+    version: int
+
+class Instruction(BaseModel):
+    recipe: str
+    ingredient: str
+    unit: str
+    quantity: float
+    preparation: Optional[str] = None
+    quantity_in_grams: Optional[float] = None
+    recipe_grams: Optional[float] = None
+
+class Nutrient(BaseModel):
+    ingredient_group: str
+    kcal: float
+    kj: float
+    fat: float
+    saturated_fatty_acids: float
+    mono_unsaturated_fatty_acids: float
+    polyunsaturated_fatty_acids: float
+    cholesterol_mg: float
+    carbohydrates: float
+    sugar: float
+    starch: float
+    dietary_fibre: float
+    protein: float
+    salt: float
+
+# /recipes/{name} and /recipes?include=..., quantities scaled to the requested portions
+class RecipeIngredient(BaseModel):
+    ingredient: str
+    unit: str
+    group: str
+    quantity: float
+    preparation: Optional[str] = None
+    price_per_unit: float
+    price: float
+    quantity_on_stock: float
+    expiration_date: Optional[date] = None
+
+class NutritionTotals(BaseModel):
+    kcal: float
+    kj: float
+    fat: float
+    saturated_fatty_acids: float
+    mono_unsaturated_fatty_acids: float
+    polyunsaturated_fatty_acids: float
+    cholesterol_mg: float
+    carbohydrates: float
+    sugar: float
+    starch: float
+    dietary_fibre: float
+    protein: float
+    salt: float
+
+class RecipeDetail(BaseModel):
+    name: str
+    description: str
+    # requested, defaults to the recipe's own
+    portions: float
+    recipe_portions: int
+    price: float
+    price_per_portion: float
+    # only when included
+    ingredients: Optional[List[RecipeIngredient]] = None
+    nutrition: Optional[NutritionTotals] = None
 
 class SuggestionRequest(BaseModel):
     portions: float
     scope: int
+    # exclude recipes incompatible with any of these diets
+    diets: List[str] = []
+
+# Scenarios evaluated together by /recipes/suggestions/batch
+MAX_SCENARIOS = 100
+
+class SuggestionBatchRequest(BaseModel):
+    scenarios: List[SuggestionRequest] = Field(min_length=1, max_length=MAX_SCENARIOS)
+    # restrict every scenario to these recipes; None means all
+    recipes: Optional[List[str]] = None
+    # keep only the first `limit` suggestions of each scenario
+    limit: Optional[int] = Field(None, ge=1)
 
 class RecipeAvailability(BaseModel):
     recipe: str
@@ -12,4 +109,143 @@ class RecipeAvailability(BaseModel):
     expiring_ingredients: str
     price_per_portion: float
     price: float
-    cost: float
\ No newline at end of file
+    cost: float
+
+class ScenarioSuggestions(BaseModel):
+    # position in SuggestionBatchRequest.scenarios
+    scenario: int
+    request: SuggestionRequest
+    suggestions: List[RecipeAvailability]
+
+class SearchResult(BaseModel):
+    kind: str
+    name: str
+    # ingredients only
+    unit: Optional[str] = None
+    score: float
+    # fields the query matched in
+    matched: List[str]
+
+class IngredientVersion(BaseModel):
+    ingredient: str
+    unit: str
+    version: int
+
+class StockRequest(BaseModel):
+    # either a recipe or the day of the menu plan to take out of stock
+    recipe: Optional[str] = None
+    day: Optional[date] = None
+    # recipe only; defaults to the recipe's own portions
+    portions: Optional[float] = Field(None, gt=0)
+    # ingredient versions as last read; any mismatch rejects the whole change
+    expected_versions: List[IngredientVersion] = []
+
+class StockItem(BaseModel):
+    ingredient: str
+    unit: str
+    required: float
+    taken: float
+    shortage: float
+    quantity_on_stock: float
+    version: int
+
+class StockChange(BaseModel):
+    mode: str
+    recipe: Optional[str]
+    day: Optional[date]
+    items: List[StockItem]
+    shortages: List[StockItem]
+
+# Longest horizon /menu-plan/generate plans
+MAX_PLAN_DAYS = 92
+
+class PlanRequest(BaseModel):
+    # defaults to today
+    start_date: Optional[date] = None
+    days: int = Field(7, ge=1, le=MAX_PLAN_DAYS)
+    meals_per_day: int = Field(1, ge=1, le=5)
+    # per meal
+    portions: float = Field(2, gt=0)
+    diets: List[str] = []
+    # replace menu_plan between start_date and the end of the horizon
+    save: bool = False
+
+class PlannedMeal(BaseModel):
+    date: date
+    meal: str
+    portions: float
+
+class MenuPlanProposal(BaseModel):
+    start_date: date
+    end_date: date
+    meals: List[PlannedMeal]
+    purchase_cost: float
+    stock_used_value: float
+    wasted_value: float
+    # the same for the greedy start, before local search
+    greedy_purchase_cost: float
+    greedy_wasted_value: float
+    rounds: int
+    moves: int
+    saved: bool
+
+class ShoppingListItem(BaseModel):
+    ingredient: str
+    unit: str
+    store: str
+    nbr_of_recipes: int
+    expiration_date: Optional[date]
+    required: float
+    quantity_on_stock: float
+    from_stock: float
+    to_buy: float
+    price_per_unit: float
+    cost: float
+    # the same quantities in grams, over every unit of the ingredient
+    required_grams: float
+    to_buy_grams: float
+
+class StoreTotal(BaseModel):
+    store: str
+    nbr_of_items: int
+    cost: float
+
+class ShoppingList(BaseModel):
+    start_date: date
+    end_date: date
+    items: List[ShoppingListItem]
+    stores: List[StoreTotal]
+    total_cost: float
+
+class WeeklyCost(BaseModel):
+    # Monday of the week
+    week: date
+    meals: int
+    portions: float
+    cost: float
+    cumulative_cost: float
+    # over this week and the 3 before it that had meals
+    moving_average_cost: float
+
+class RecipeFrequency(BaseModel):
+    recipe: str
+    rank: int
+    times: int
+    portions: float
+    # of all meals in the range
+    share: float
+    first_planned: date
+    last_planned: date
+
+class IngredientConsumption(BaseModel):
+    # first day of the week or month
+    period: date
+    ingredient: str
+    # quantities over every unit of the ingredient, in the one cheapest per gram
+    unit: str
+    quantity: float
+    quantity_in_grams: float
+    cost: float
+    cumulative_quantity: float
+    cumulative_cost: float
+    moving_average_quantity: float
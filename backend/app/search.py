@@ -0,0 +1,317 @@
+import bisect
+import itertools
+import re
+import threading
+import unicodedata
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache import data_version
+
+
+MAX_SEARCH_RESULTS = 100
+# Weight of a match in each field of a recipe; ingredients only have a name
+RECIPE_FIELDS = {"name": 3.0, "ingredients": 2.0, "description": 1.0, "preparation": 0.5}
+INGREDIENT_NAME_WEIGHT = 3.0
+# Query tokens match vocabulary tokens exactly, as a prefix, or failing
+# both by trigram similarity (pg_trgm's default threshold)
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+SIMILARITY_THRESHOLD = 0.3
+MAX_EXPANSIONS = 100
+
+_TOKEN = re.compile(r"[^\W_]+")
+# what NFKD leaves composed
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ø": "o", "ł": "l", "đ": "d"})
+
+
+def fold(value: str) -> str:
+    """Lower case without accents: "Crêpes sucrées" -> "crepes sucrees"."""
+    if value.isascii():
+        return value.lower()
+    decomposed = unicodedata.normalize("NFKD", value.casefold().translate(_LIGATURES))
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    return _TOKEN.findall(fold(value)) if value else []
+
+
+def trigrams(token: str) -> set:
+    # padded like pg_trgm, so short words and word starts count
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Vocabulary:
+    """Token ids, with lookups by prefix (sorted list) and by trigram."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def add(self, tokens) -> List[int]:
+        return [self.ids.setdefault(t, len(self.ids)) for t in tokens]
+
+    def freeze(self):
+        self.sorted = sorted(self.ids)
+        self.sorted_ids = [self.ids[t] for t in self.sorted]
+        gram_ids, pairs = {}, []
+        for token, k in self.ids.items():
+            # numbers (recipe 123) are found exactly or by prefix, never fuzzily
+            if not token.isdigit():
+                pairs.extend((gram_ids.setdefault(g, len(gram_ids)), k) for g in trigrams(token))
+        self.gram_ids = gram_ids
+        grams = np.array([g for g, _ in pairs], dtype=np.int64)
+        tokens = np.array([k for _, k in pairs], dtype=np.int64)
+        self.gram_ptr, self.gram_tokens = _csr(grams, tokens, len(gram_ids))
+        self.gram_counts = np.bincount(tokens, minlength=len(self.ids))
+
+    def matches(self, token: str):
+        """[(token id, weight)] of the vocabulary tokens query token matches."""
+        k = self.ids.get(token)
+        found = [(k, 1.0)] if k is not None else []
+        start = bisect.bisect_left(self.sorted, token)
+        for i in range(start, min(start + MAX_EXPANSIONS, len(self.sorted))):
+            if not self.sorted[i].startswith(token):
+                break
+            if self.sorted[i] != token:
+                found.append((self.sorted_ids[i], PREFIX_WEIGHT))
+        if found or len(token) < 3:
+            return found
+
+        grams = [self.gram_ids[g] for g in trigrams(token) if g in self.gram_ids]
+        if not grams:
+            return []
+        candidates = np.concatenate([self.gram_tokens[self.gram_ptr[g]:self.gram_ptr[g + 1]] for g in grams])
+        ids, shared = np.unique(candidates, return_counts=True)
+        similarity = shared / (len(trigrams(token)) + self.gram_counts[ids] - shared)
+        keep = np.flatnonzero(similarity >= SIMILARITY_THRESHOLD)
+        keep = keep[np.argsort(-similarity[keep], kind="stable")][:MAX_EXPANSIONS]
+        return [(k, FUZZY_WEIGHT * s) for k, s in zip(ids[keep].tolist(), similarity[keep].tolist())]
+
+
+def _csr(keys, values, n_keys):
+    """Sorted, de-duplicated (key, value) pairs as (indptr, values): the
+    values of key k are values[indptr[k]:indptr[k + 1]]."""
+    n_values = int(values.max()) + 1 if len(values) else 1
+    # sort and drop repeats: much faster than np.unique on large arrays
+    pairs = np.sort(keys * n_values + values)
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    keys, values = pairs // n_values, pairs % n_values
+    indptr = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=indptr[1:])
+    return indptr, values
+
+
+def _flatten(lists):
+    """Lists of ints as (indptr, values)."""
+    counts = np.array([len(x) for x in lists], dtype=np.int64)
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, np.array([v for x in lists for v in x], dtype=np.int64)
+
+
+def _expand(indptr, values, idx, owners):
+    """For each i, every value of list idx[i] paired with owners[i], as
+    (values, owners) arrays."""
+    counts = indptr[idx + 1] - indptr[idx]
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    positions = np.repeat(indptr[idx] - offsets, counts) + np.arange(counts.sum())
+    return values[positions], np.repeat(owners, counts)
+
+
+class SearchIndex:
+    """
+    Inverted index over recipe names, descriptions, ingredient names and
+    preparations, plus ingredient names on their own, held in memory. Every
+    field maps token ids to sorted document ids (CSR), and the vocabulary
+    has a trigram index for fuzzy matches. Text is folded (lower case, no
+    accents) on both sides, so "crepes" finds "Crêpes sucrées".
+
+    Rebuilt when data_versions 'catalog' moves on; stock and price updates
+    leave it alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def load(self, db: Session, version: int):
+        # One plain statement, so every row comes from the same snapshot on any
+        # database: recipes and ingredients in name order, then the instructions
+        rows = db.execute(text("""
+            SELECT kind, a, b, c, d
+            FROM (
+                SELECT 0 AS kind, name AS a, description AS b, NULL AS c, NULL AS d FROM recipes
+                UNION ALL
+                SELECT 1, name, unit, NULL, NULL FROM ingredients
+                UNION ALL
+                SELECT 2, recipe, ingredient, unit, COALESCE(preparation, '') FROM instructions
+            ) u
+            -- instructions need no order
+            ORDER BY kind, CASE WHEN kind < 2 THEN a END, CASE WHEN kind = 1 THEN b END
+        """)).all()
+        by_kind = {kind: list(group) for kind, group in itertools.groupby(rows, key=lambda row: row[0])}
+        recipes = [row[1] for row in by_kind.get(0, [])]
+        descriptions = [row[2] for row in by_kind.get(0, [])]
+        ingredients = [row[1] for row in by_kind.get(1, [])]
+        units = [row[2] for row in by_kind.get(1, [])]
+        instructions = by_kind.get(2, [])
+        preparations = sorted({row[4] for row in instructions})
+
+        # instructions as positions into the name lists
+        recipe_pos = {name: k for k, name in enumerate(recipes)}
+        ing_pos = {key: k for k, key in enumerate(zip(ingredients, units))}
+        prep_pos = {p: k for k, p in enumerate(preparations)}
+        n = len(instructions)
+        row_recipe = np.fromiter((recipe_pos[row[1]] for row in instructions), dtype=np.int64, count=n)
+        row_ing = np.fromiter((ing_pos[row[2], row[3]] for row in instructions), dtype=np.int64, count=n)
+        row_prep = np.fromiter((prep_pos[row[4]] for row in instructions), dtype=np.int64, count=n)
+
+        vocabulary = _Vocabulary()
+        ing_tokens = _flatten([vocabulary.add(tokenize(name)) for name in ingredients])
+        prep_tokens = _flatten([vocabulary.add(tokenize(p)) for p in preparations])
+        every_recipe = np.arange(len(recipes))
+        # (token, recipe) pairs per field
+        fields = {
+            field: _expand(*_flatten([vocabulary.add(tokenize(v)) for v in values]), every_recipe, every_recipe)
+            for field, values in (("name", recipes), ("description", descriptions))
+        }
+        fields["ingredients"] = _expand(*ing_tokens, row_ing, row_recipe)
+        fields["preparation"] = _expand(*prep_tokens, row_prep, row_recipe)
+        vocabulary.freeze()
+
+        # Swapped in as a whole so concurrent readers never see a half-load
+        x = SimpleNamespace(version=version, vocabulary=vocabulary)
+        x.recipes = recipes
+        x.ingredients = list(zip(ingredients, units))
+        n_tokens = len(vocabulary.ids)
+        x.recipe_fields = {f: _csr(tokens, owners, n_tokens) for f, (tokens, owners) in fields.items()}
+        every_ingredient = np.arange(len(ingredients))
+        x.ingredient_names = _csr(*_expand(*ing_tokens, every_ingredient, every_ingredient), n_tokens)
+        # ingredient -> recipes using it, and distinct ingredients per recipe
+        x.ingredient_recipes = _csr(row_ing, row_recipe, len(ingredients))
+        x.recipe_sizes = np.bincount(x.ingredient_recipes[1], minlength=len(recipes))
+
+        with self._lock:
+            self._index = x
+        return x
+
+    def current(self, db: Session):
+        version = data_version("catalog")
+        x = self._index
+        if x is None or x.version != version:
+            x = self.load(db, version)
+        return x
+
+    def search(self, db: Session, q: Optional[str], ingredients: List[str], kind: str = "all", limit: int = 20):
+        """
+        Top `limit` recipes and/or ingredients for the words of q, best score
+        first, ties by name. Every word must match somewhere; `ingredients`
+        further restricts recipes to those using all of them.
+        """
+        x = self.current(db)
+        words = tokenize(q)
+        results = []
+        if kind in ("all", "recipe"):
+            results += _search_recipes(x, words, ingredients, limit)
+        # an ingredients filter asks for recipes
+        if kind in ("all", "ingredient") and words and not ingredients:
+            results += _search_ingredients(x, words, limit)
+        results.sort(key=lambda r: (-r["score"], r["kind"], r["name"], r["unit"] or ""))
+        return results[:limit]
+
+
+def _score(x, words, fields, n_docs):
+    """
+    Per document: the sum over words of the best weighted match, and the
+    fields each word matched in. Documents missing a word score 0.
+    """
+    total = np.zeros(n_docs)
+    matched = {field: np.zeros(n_docs, dtype=bool) for field in fields}
+    for word in words:
+        best = np.zeros(n_docs)
+        for k, weight in x.vocabulary.matches(word):
+            for field, (field_weight, (indptr, docs)) in fields.items():
+                hits = docs[indptr[k]:indptr[k + 1]]
+                if len(hits):
+                    best[hits] = np.maximum(best[hits], weight * field_weight)
+                    matched[field][hits] = True
+        found = best > 0
+        total = np.where(found, total + best, -np.inf)
+    return np.maximum(total, 0), matched
+
+
+def _top(scores, limit):
+    """Indices of the `limit` best positive scores, ties in index (name) order."""
+    docs = np.flatnonzero(scores > 0)
+    if len(docs) > limit:
+        threshold = np.partition(scores[docs], len(docs) - limit)[len(docs) - limit]
+        docs = docs[scores[docs] >= threshold]
+    return docs[np.argsort(-scores[docs], kind="stable")][:limit]
+
+
+def _matching_ingredients(x, term):
+    """Ingredients whose name matches every word of term."""
+    words = tokenize(term)
+    if not words:
+        return np.zeros(0, dtype=np.int64)
+    scores, _ = _score(x, words, {"name": (1.0, x.ingredient_names)}, len(x.ingredients))
+    return np.flatnonzero(scores > 0)
+
+
+def _search_recipes(x, words, ingredients, limit):
+    n_recipes = len(x.recipes)
+    allowed = None
+    for term in ingredients:
+        # any ingredient matching the term will do, every term is needed
+        indptr, recipes = x.ingredient_recipes
+        using = np.zeros(n_recipes, dtype=bool)
+        for k in _matching_ingredients(x, term).tolist():
+            using[recipes[indptr[k]:indptr[k + 1]]] = True
+        allowed = using if allowed is None else allowed & using
+
+    if words:
+        fields = {f: (weight, x.recipe_fields[f]) for f, weight in RECIPE_FIELDS.items()}
+        scores, matched = _score(x, words, fields, n_recipes)
+        if allowed is not None:
+            scores = np.where(allowed, scores, 0)
+    elif allowed is not None:
+        # the more of a recipe the requested ingredients make up, the better
+        scores = np.where(allowed, len(ingredients) / np.maximum(x.recipe_sizes, 1), 0)
+        matched = {"ingredients": allowed}
+    else:
+        return []
+
+    return [
+        {
+            "kind": "recipe",
+            "name": x.recipes[r],
+            "unit": None,
+            "score": round(float(scores[r]), 4),
+            "matched": [f for f in matched if matched[f][r]],
+        }
+        for r in _top(scores, limit).tolist()
+    ]
+
+
+def _search_ingredients(x, words, limit):
+    fields = {"name": (INGREDIENT_NAME_WEIGHT, x.ingredient_names)}
+    scores, _ = _score(x, words, fields, len(x.ingredients))
+    return [
+        {
+            "kind": "ingredient",
+            "name": x.ingredients[k][0],
+            "unit": x.ingredients[k][1],
+            "score": round(float(scores[k]), 4),
+            "matched": ["name"],
+        }
+        for k in _top(scores, limit).tolist()
+    ]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,53 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union, get_args, get_origin
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
+
+from .metrics import serializing
+
+
+# FastAPI validates a handler's return value against its response_model and
+# runs it through jsonable_encoder, which costs more than the query on list
+# endpoints (30ms for 1000 instruction rows). The encoders below serialize
+# plain dicts and lists straight to JSON bytes instead: the schema only
+# supplies the field types, nothing is validated or copied.
+
+def _plain(annotation):
+    # BaseModel -> TypedDict with the same fields, through List[...] and Optional[...]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _typed_dict(annotation, tuple(annotation.model_fields))
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        return List[_plain(get_args(annotation)[0])]
+    if origin is Union:
+        return Union[tuple(_plain(arg) for arg in get_args(annotation))]
+    return annotation
+
+
+@lru_cache(maxsize=None)
+def _typed_dict(schema, fields: Tuple[str, ...]):
+    return TypedDict(
+        f"{schema.__name__}Row", {name: _plain(schema.model_fields[name].annotation) for name in fields}
+    )
+
+
+@lru_cache(maxsize=None)
+def json_encoder(schema, fields: Optional[Tuple[str, ...]] = None, many: bool = True) -> TypeAdapter:
+    """
+    Compiled encoder for dicts shaped like `schema` (restricted to `fields`,
+    e.g. a ?fields= projection), or lists of them with `many`. Nested models
+    are expected as dicts too.
+    """
+    row = _typed_dict(schema, fields or tuple(schema.model_fields))
+    return TypeAdapter(List[row] if many else row)
+
+
+def encode(encoder: TypeAdapter, content) -> bytes:
+    with serializing():
+        return encoder.dump_json(content)
+
+
+def json_response(encoder: TypeAdapter, content, headers=None) -> Response:
+    return Response(content=encode(encoder, content), media_type="application/json", headers=headers)
@@ -0,0 +1,94 @@
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# One pass over menu_plan x instructions for the whole date range, per product:
+# the units an ingredient is stocked and used in pool in grams (see units.py).
+# Each stock row only covers meals planned on or before its expiration date;
+# the rest is bought in the unit that is cheapest per gram. Recipes of 0
+# portions give no per-portion quantities and are left out.
+SHOPPING_LIST_SQL = text("""
+    WITH needs AS (
+        -- one row per stock row (unit) of every ingredient the plan uses
+        SELECT
+            s.name                                                              AS ingredient,
+            s.stock_in_grams                                                    AS stock_in_grams,
+            s.expiration_date                                                   AS expiration_date,
+            SUM(m.quantity_in_grams * mp.portions / NULLIF(r.portions, 0))                 AS required_grams,
+            SUM(
+                CASE
+                    WHEN s.expiration_date IS NULL OR mp.date <= s.expiration_date
+                    THEN m.quantity_in_grams * mp.portions / NULLIF(r.portions, 0)
+                    ELSE 0
+                END
+            )                                                                   AS required_grams_before_expiry,
+            COUNT(DISTINCT mp.meal)                                             AS nbr_of_recipes
+        FROM menu_plan mp
+        JOIN recipes r ON r.name = mp.meal
+        JOIN instructions m ON m.recipe = mp.meal
+        JOIN ingredients s ON s.name = m.ingredient
+        WHERE mp.date BETWEEN :start_date AND :end_date
+          AND r.portions > 0
+        GROUP BY s.name, s.unit
+    ),
+    products AS (
+        SELECT
+            ingredient,
+            MAX(nbr_of_recipes)                                                 AS nbr_of_recipes,
+            -- the first of the units on stock to expire
+            COALESCE(MIN(expiration_date) FILTER (WHERE stock_in_grams > 0), MIN(expiration_date)) AS expiration_date,
+            MAX(required_grams)                                                 AS required_grams,
+            SUM(stock_in_grams)                                                 AS stock_in_grams,
+            LEAST(MAX(required_grams), SUM(LEAST(stock_in_grams, required_grams_before_expiry))) AS from_stock_grams
+        FROM needs
+        GROUP BY ingredient
+    ),
+    purchase AS (
+        SELECT DISTINCT ON (name) name, unit, store, price_per_unit, g_per_unit
+        FROM ingredients
+        ORDER BY name, price_per_unit / g_per_unit, unit
+    )
+    SELECT
+        p.ingredient,
+        u.unit,
+        u.store,
+        p.nbr_of_recipes,
+        p.expiration_date,
+        p.required_grams / u.g_per_unit                                         AS required,
+        p.stock_in_grams / u.g_per_unit                                         AS quantity_on_stock,
+        p.from_stock_grams / u.g_per_unit                                       AS from_stock,
+        (p.required_grams - p.from_stock_grams) / u.g_per_unit                  AS to_buy,
+        u.price_per_unit,
+        ROUND(((p.required_grams - p.from_stock_grams) / u.g_per_unit * u.price_per_unit)::numeric, 2) AS cost,
+        p.required_grams,
+        p.required_grams - p.from_stock_grams                                   AS to_buy_grams
+    FROM products p
+    JOIN purchase u ON u.name = p.ingredient
+    ORDER BY u.store, p.ingredient;
+""")
+
+
+
+async def shopping_list(db: AsyncSession, start_date: date, end_date: date):
+    """
+    Everything the menu plan needs between start_date and end_date (inclusive),
+    with recipe quantities scaled by menu_plan.portions / recipes.portions and
+    aggregated per ingredient over all its units, then per store.
+    """
+    result = await db.execute(SHOPPING_LIST_SQL, {"start_date": start_date, "end_date": end_date})
+    items = [dict(row._mapping) for row in result]
+    stores = {}
+    for item in items:
+        store = stores.setdefault(item["store"], {"store": item["store"], "nbr_of_items": 0, "cost": 0})
+        if item["to_buy"] > 0:
+            store["nbr_of_items"] += 1
+        store["cost"] += item["cost"]
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "items": items,
+        "stores": list(stores.values()),
+        "total_cost": sum(s["cost"] for s in stores.values()),
+    }
@@ -0,0 +1,183 @@
+from datetime import date
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# What a consumption draws on: one (recipe, portions) row per dish
+RECIPE_TARGETS = """
+    SELECT r.name AS recipe, COALESCE(CAST(:portions AS double precision), r.portions) AS portions
+    FROM recipes r
+    WHERE r.name = :recipe
+"""
+MENU_DAY_TARGETS = """
+    SELECT mp.meal AS recipe, mp.portions AS portions
+    FROM menu_plan mp
+    WHERE mp.date = :date
+"""
+
+# One statement per consumption. The ingredient rows are locked in key order,
+# so concurrent calls over overlapping ingredients queue on the rows they
+# share instead of deadlocking, and whatever they read is the latest
+# committed stock. The optimistic version check and, for a checked consume,
+# the all-or-nothing rule are decided for every row at once: either every
+# ingredient is decremented in a single UPDATE ... FROM or none is.
+#
+# Needs pool in grams over every unit of an ingredient (see units.py) and are
+# drawn from its stock rows in any unit, the first to expire first. What the
+# rows cannot cover is the shortage of the row drawn last. Recipes of 0
+# portions have no per-portion quantities and are left out.
+_CONSUME_SQL = """
+    WITH targets AS ({targets}),
+    needs AS (
+        SELECT m.ingredient, SUM(m.quantity_in_grams * t.portions / NULLIF(r.portions, 0)) AS required_grams
+        FROM targets t
+        JOIN recipes r ON r.name = t.recipe
+        JOIN instructions m ON m.recipe = t.recipe
+        WHERE r.portions > 0
+        GROUP BY m.ingredient
+    ),
+    expected AS (
+        SELECT *
+        FROM unnest(
+            CAST(:expected_ingredients AS text[]), CAST(:expected_units AS text[]), CAST(:expected_versions AS bigint[])
+        ) AS e(ingredient, unit, version)
+    ),
+    locked AS MATERIALIZED (
+        SELECT i.name, i.unit, i.g_per_unit, i.quantity_on_stock, i.version, i.expiration_date, n.required_grams,
+               -- expired stock stays where it is and counts as missing
+               CASE WHEN i.expiration_date < CURRENT_DATE THEN 0
+                    ELSE GREATEST(i.quantity_on_stock, 0) * i.g_per_unit
+               END AS available_grams
+        FROM ingredients i
+        JOIN needs n ON n.ingredient = i.name
+        ORDER BY i.name, i.unit
+        FOR UPDATE OF i
+    ),
+    drawn AS (
+        SELECT
+            l.*,
+            LEAST(l.available_grams, GREATEST(l.required_grams - COALESCE(SUM(l.available_grams) OVER earlier, 0), 0))
+                                                                AS taken_grams,
+            CASE WHEN ROW_NUMBER() OVER draw = COUNT(*) OVER (PARTITION BY l.name)
+                 THEN GREATEST(l.required_grams - SUM(l.available_grams) OVER (PARTITION BY l.name), 0)
+                 ELSE 0
+            END                                                 AS shortage_grams
+        FROM locked l
+        WINDOW
+            draw AS (PARTITION BY l.name ORDER BY l.available_grams = 0, l.expiration_date NULLS LAST, l.unit),
+            earlier AS (draw ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+    ),
+    checked AS MATERIALIZED (
+        SELECT
+            d.name,
+            d.unit,
+            d.quantity_on_stock,
+            d.version,
+            e.version                                           AS expected_version,
+            -- a row drawn on completely is emptied, without rounding residue
+            CASE WHEN d.taken_grams = d.available_grams AND d.taken_grams > 0 THEN d.quantity_on_stock
+                 ELSE d.taken_grams / d.g_per_unit
+            END                                                 AS taken,
+            d.shortage_grams / d.g_per_unit                     AS shortage
+        FROM drawn d
+        LEFT JOIN expected e ON e.ingredient = d.name AND e.unit = d.unit
+    ),
+    blocked AS (
+        SELECT
+            COALESCE(bool_or(expected_version <> version), false) AS conflict,
+            COALESCE(bool_or(shortage > 0), false)                AS short
+        FROM checked
+    ),
+    updated AS (
+        UPDATE ingredients i
+        SET quantity_on_stock = i.quantity_on_stock - c.taken,
+            version = i.version + 1
+        FROM checked c, blocked b
+        WHERE i.name = c.name AND i.unit = c.unit
+          AND c.taken > 0
+          AND NOT b.conflict
+          AND NOT (:all_or_nothing AND b.short)
+        RETURNING i.name, i.unit, i.quantity_on_stock, i.version
+    )
+    SELECT
+        c.name                                          AS ingredient,
+        c.unit                                          AS unit,
+        c.taken + c.shortage                            AS required,
+        CASE WHEN u.name IS NULL THEN 0 ELSE c.taken END AS taken,
+        c.shortage                                      AS shortage,
+        COALESCE(u.quantity_on_stock, c.quantity_on_stock) AS quantity_on_stock,
+        COALESCE(u.version, c.version)                  AS version,
+        c.version                                       AS read_version,
+        c.expected_version                              AS expected_version
+    FROM checked c
+    LEFT JOIN updated u ON u.name = c.name AND u.unit = c.unit
+    ORDER BY c.name, c.unit
+"""
+CONSUME_RECIPE_SQL = text(_CONSUME_SQL.format(targets=RECIPE_TARGETS))
+CONSUME_MENU_DAY_SQL = text(_CONSUME_SQL.format(targets=MENU_DAY_TARGETS))
+
+
+async def consume_stock(
+    db: AsyncSession,
+    mode: str,
+    recipe: Optional[str] = None,
+    day: Optional[date] = None,
+    portions: Optional[float] = None,
+    expected: Optional[List[dict]] = None,
+):
+    """
+    Take the ingredients of a recipe, or of every meal planned on `day`,
+    out of stock. Recipe quantities are scaled by portions / recipes.portions
+    like the shopping list, and pooled in grams over the units. There is one
+    item per stock row of every ingredient used: `required` is the part of
+    the need put on that row.
+
+    "cook" takes what is there and reports the rest as shortages; "consume"
+    is a checked consume, all or nothing: with any shortage nothing is taken
+    (409). Neither holds stock back for later. Expired stock is never taken. `expected` lists
+    {ingredient, unit, version} as the caller last read them; if any of those
+    rows changed since, nothing is taken (409). The caller commits.
+    """
+    statement, params = consume_statement(mode, recipe, day, portions, expected)
+    result = await db.execute(statement, params)
+    return consume_result(mode, recipe, day, [dict(row._mapping) for row in result])
+
+
+def consume_statement(mode, recipe=None, day=None, portions=None, expected=None):
+    """The statement consume_stock() runs and its parameters."""
+    expected = expected or []
+    params = {
+        "expected_ingredients": [e["ingredient"] for e in expected],
+        "expected_units": [e["unit"] for e in expected],
+        "expected_versions": [e["version"] for e in expected],
+        "all_or_nothing": mode == "consume",
+    }
+    if recipe is not None:
+        statement = CONSUME_RECIPE_SQL
+        params.update(recipe=recipe, portions=portions)
+    else:
+        statement = CONSUME_MENU_DAY_SQL
+        params.update(date=day)
+    return statement, params
+
+
+def consume_result(mode, recipe, day, items):
+    """The StockChange for the rows of the statement, or the 404/409 to raise."""
+    if not items:
+        target = f"recipe {recipe}" if recipe is not None else f"menu plan of {day.isoformat()}"
+        raise HTTPException(status_code=404, detail=f"No ingredients found for {target}")
+
+    conflicts = []
+    for item in items:
+        read, wanted = item.pop("read_version"), item.pop("expected_version")
+        if wanted is not None and wanted != read:
+            conflicts.append({"ingredient": item["ingredient"], "unit": item["unit"], "expected": wanted, "version": read})
+    if conflicts:
+        raise HTTPException(status_code=409, detail={"message": "Stock changed since it was read", "conflicts": conflicts})
+    shortages = [item for item in items if item["shortage"] > 0]
+    if mode == "consume" and shortages:
+        raise HTTPException(status_code=409, detail={"message": "Not enough stock to consume", "shortages": shortages})
+    return {"mode": mode, "recipe": recipe, "day": day, "items": items, "shortages": shortages}
@@ -0,0 +1,350 @@
+import threading
+from datetime import date
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .schemas import SuggestionRequest
+from .diets import combine_masks, load_diet_masks
+from .cache import data_version
+
+
+# Stand-in ordinal for a NULL expiration date: never expired, never expiring
+NO_EXPIRY = np.iinfo(np.int64).max
+
+
+def _round2(values):
+    # Emulate Postgres ROUND(x::numeric, 2): the float -> numeric cast keeps 15
+    # significant digits, so sums like 2.67499999999 become 2.675 and round
+    # half away from zero. The small relative nudge reproduces that.
+    scaled = np.abs(values) * 100
+    rounded = np.floor(scaled + 0.5 + np.maximum(scaled, 1.0) * 2.0 ** -50)
+    return np.copysign(rounded / 100, values)
+
+
+class SuggestionEngine:
+    """
+    Columnar, in-memory equivalent of the /recipes/suggestions SQL aggregate.
+
+    Recipes are stored CSR-style: the instruction rows of recipe r live in
+    [starts[r], starts[r] + counts[r]) and point into the ingredient arrays
+    through ing_idx. Every request is then a handful of gathers and segment sums.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None
+
+    def load(self, db: Session, version: int):
+        # versions are read before the data, so the snapshot is never older than its label
+        catalog = data_version("catalog")
+        ingredients = _read_ingredients(db)
+        # Same inner join as v_instructions, in primary key order: recipes come
+        # out sorted and labels in the order the SQL string_agg uses
+        instructions = db.execute(text("""
+            SELECT m.recipe, m.ingredient, m.unit, m.quantity, m.recipe_grams, r.portions
+            FROM instructions m
+            JOIN recipes r ON r.name = m.recipe
+            JOIN ingredients i ON i.name = m.ingredient AND i.unit = m.unit
+            ORDER BY m.recipe, m.ingredient, m.unit
+        """)).all()
+
+        exclusions = dict(db.execute(text("SELECT recipe, mask FROM recipe_exclusions")).all())
+        diet_masks = load_diet_masks(db)
+
+        ing_pos = {(row.name, row.unit): k for k, row in enumerate(ingredients)}
+        recipes, portions, counts = [], [], []
+        for row in instructions:
+            if not recipes or recipes[-1] != row.recipe:
+                recipes.append(row.recipe)
+                portions.append(row.portions)
+                counts.append(0)
+            counts[-1] += 1
+
+        # Swapped in as a whole so concurrent readers never see a half-load
+        a = SimpleNamespace(version=version, catalog=catalog)
+        a.recipes = recipes
+        a.counts = np.array(counts, dtype=np.int64)
+        a.starts = np.concatenate(([0], np.cumsum(a.counts)[:-1])).astype(np.int64)
+        a.portions = np.array(portions, dtype=np.float64)
+        a.masks = np.array([exclusions.get(r, 0) for r in recipes], dtype=np.int64)
+        a.diet_masks = diet_masks
+        a.row_recipe = np.repeat(np.arange(len(recipes)), a.counts)
+        a.ing_idx = np.array([ing_pos[(row.ingredient, row.unit)] for row in instructions], dtype=np.int64)
+        a.quantity = np.array([row.quantity for row in instructions], dtype=np.float64)
+        # grams of the row's ingredient the recipe needs over all units, at its own portions
+        a.row_grams = np.array([row.recipe_grams for row in instructions], dtype=np.float64)
+        _set_ingredient_columns(a, ingredients)
+
+        with self._lock:
+            self._arrays = a
+        return a
+
+    def refresh_ingredients(self, db: Session, a, version: int):
+        """
+        A copy of snapshot a with stock, prices and expiry dates re-read, for
+        when only ingredients were written since it was loaded. Costs one scan
+        of ingredients instead of the whole load. None if the ingredient rows
+        no longer line up with the instructions of a.
+        """
+        ingredients = _read_ingredients(db)
+        ing_pos = {(row.name, row.unit): k for k, row in enumerate(ingredients)}
+        try:
+            moved = np.array([ing_pos[key] for key in a.ingredient_keys], dtype=np.int64)
+        except KeyError:
+            return None
+        b = SimpleNamespace(**vars(a))
+        b.version = version
+        b.ing_idx = moved[a.ing_idx]
+        _set_ingredient_columns(b, ingredients)
+
+        with self._lock:
+            self._arrays = b
+        return b
+
+    def arrays(self, db: Session, version: int = None):
+        """The current snapshot, brought up to date when data_versions moved on."""
+        if version is None:
+            version = data_version()
+        a = self._arrays
+        if a is not None and a.version != version and a.catalog == data_version("catalog"):
+            a = self.refresh_ingredients(db, a, version)
+        if a is None or a.version != version:
+            a = self.load(db, version)
+        return a
+
+    def compute(self, request: SuggestionRequest, db: Session, today: date = None, version: int = None):
+        """Vectorized pass over all instruction rows; returns per-recipe columns."""
+        a = self.arrays(db, version)
+        return _evaluate(a, [request], today)[0]
+
+    def compute_batch(
+        self,
+        requests: List[SuggestionRequest],
+        db: Session,
+        recipes: Optional[List[str]] = None,
+        today: date = None,
+        version: int = None,
+    ):
+        """compute() for many scenarios over one snapshot, optionally restricted
+        to some recipes."""
+        a = self.arrays(db, version)
+        if recipes is not None:
+            a = _subset(a, recipes)
+        return _evaluate(a, requests, today)
+
+    def suggest(self, request: SuggestionRequest, db: Session, today: date = None, version: int = None):
+        """Same rows, in the same order, as the SQL aggregate."""
+        return _rows(self.compute(request, db, today, version))
+
+    def suggest_batch(
+        self,
+        requests: List[SuggestionRequest],
+        db: Session,
+        recipes: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        today: date = None,
+        version: int = None,
+    ):
+        """suggest() for every request, in request order, cut to the first
+        `limit` rows of each."""
+        return [_rows(result, limit) for result in self.compute_batch(requests, db, recipes, today, version)]
+
+
+def _read_ingredients(db: Session):
+    return db.execute(text("""
+        SELECT name, unit, g_per_unit, price_per_unit, stock_in_grams, expiration_date
+        FROM ingredients
+    """)).all()
+
+
+def _set_ingredient_columns(a, ingredients):
+    """(Re)derive the per-row columns of snapshot a that come from the
+    ingredients table; a.ing_idx must index into `ingredients`."""
+    a.ingredient_keys = [(row.name, row.unit) for row in ingredients]
+    price_per_unit = np.array([row.price_per_unit for row in ingredients], dtype=np.float64)
+    g_per_unit = np.array([row.g_per_unit for row in ingredients], dtype=np.float64)
+    expiry = np.array(
+        [row.expiration_date.toordinal() if row.expiration_date else NO_EXPIRY for row in ingredients],
+        dtype=np.int64,
+    )
+    labels = np.array(
+        [f"{row.name} ({row.expiration_date.isoformat()}) " if row.expiration_date else "" for row in ingredients],
+        dtype=object,
+    )
+    # per stock row, for the menu planner
+    a.price_per_g, a.expiry = price_per_unit / g_per_unit, expiry
+    # stock rows pool by ingredient name, in grams
+    names = {name: k for k, name in enumerate(sorted({row.name for row in ingredients}))}
+    a.ing_name = np.array([names[row.name] for row in ingredients], dtype=np.int64)
+    a.stock_g = np.array([row.stock_in_grams for row in ingredients], dtype=np.float64)
+    a.row_name = a.ing_name[a.ing_idx]
+    a.row_price_per_unit = price_per_unit[a.ing_idx]
+    a.row_expiry = expiry[a.ing_idx]
+    a.row_has_expiry = a.row_expiry != NO_EXPIRY
+    a.row_price = a.row_price_per_unit * a.quantity
+    a.row_price_per_g = np.divide(a.row_price, a.row_grams, out=np.zeros_like(a.row_price), where=a.row_grams > 0)
+    a.labels = labels[a.ing_idx]
+    # price_per_portion does not depend on the request
+    a.price_per_portion = (
+        _round2(np.add.reduceat(a.row_price / a.portions[a.row_recipe], a.starts)).tolist()
+        if a.recipes else []
+    )
+
+
+def _evaluate(a, requests, today=None):
+    """
+    Per-recipe columns for each request. Scenarios share work: the sums that
+    depend on portions are computed once per distinct portions value and the
+    expiry counts once per distinct scope, so a grid of 10 portions x 5
+    scopes costs 15 passes over the rows, not 50.
+    """
+    today = (today or date.today()).toordinal()
+    excludes = [combine_masks(a.diet_masks, request.diets) for request in requests]
+    if not a.recipes:
+        return [SimpleNamespace(arrays=a, order=[]) for _ in requests]
+
+    days_left = a.row_expiry - today
+    usable, restockable = _pooled_stock(a, today)
+    # the restockable stock offsets the cost of each of the ingredient's rows
+    # in proportion to what the row needs, a fixed amount per row
+    restock_offset = restockable * a.row_price_per_g
+    by_portions = {}
+    for portions in {request.portions for request in requests}:
+        factor = (portions / a.portions)[a.row_recipe]
+        price = a.row_price * factor
+        needed_g = a.row_grams * factor
+        # a row is missing when all units of its ingredient together fall short
+        short = needed_g > usable
+        by_portions[portions] = (
+            np.add.reduceat(short.view(np.int8), a.starts, dtype=np.int64),
+            _round2(np.add.reduceat(price, a.starts)),
+            _round2(np.add.reduceat(price - restock_offset * (needed_g > restockable), a.starts)),
+        )
+    by_scope = {}
+    for scope in {request.scope for request in requests}:
+        expiring = a.row_has_expiry & (days_left >= 0) & (days_left < scope)
+        nbr_expiring = np.add.reduceat(expiring.view(np.int8), a.starts, dtype=np.int64)
+        by_scope[scope] = (nbr_expiring, expiring, np.argsort(-nbr_expiring, kind="stable"))
+
+    results = []
+    for request, exclude in zip(requests, excludes):
+        missing, price, cost = by_portions[request.portions]
+        nbr_expiring, expiring, order = by_scope[request.scope]
+        if exclude:
+            # one bitwise test per recipe drops everything the diets rule out
+            order = order[(a.masks[order] & exclude) == 0]
+        results.append(SimpleNamespace(
+            arrays=a,
+            order=order,
+            missing_ingredients=missing,
+            expiring_within_scope=nbr_expiring,
+            expiring=expiring,
+            price=price,
+            cost=cost,
+        ))
+    return results
+
+
+def _pooled_stock(a, today):
+    """
+    Per instruction row, the grams of its ingredient on stock over all units:
+    not expired (usable, covers needs) and expiring after today (restockable,
+    offsets the cost), like days_to_expiry >= 0 and > 0 in the SQL.
+    """
+    days_left = a.expiry - today
+    usable = np.bincount(a.ing_name, a.stock_g * (days_left >= 0), minlength=a.ing_name.max(initial=-1) + 1)
+    restockable = np.bincount(
+        a.ing_name, a.stock_g * ((a.expiry != NO_EXPIRY) & (days_left > 0)), minlength=len(usable)
+    )
+    return usable[a.row_name], restockable[a.row_name]
+
+
+def _recipe_rows(a, idx):
+    """Positions of the instruction rows of recipes idx, recipe after recipe."""
+    counts = a.counts[idx]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    return np.repeat(a.starts[idx] - starts, counts) + np.arange(counts.sum())
+
+
+def _expiring_text(a, expiring, idx):
+    """The joined expiring labels of each recipe of idx."""
+    rows = _recipe_rows(a, idx)
+    rows = rows[expiring[rows]]
+    text = dict.fromkeys(idx.tolist(), "")
+    if len(rows):
+        # rows of a recipe are contiguous, so its labels are one run
+        owners = a.row_recipe[rows]
+        bounds = np.flatnonzero(np.diff(owners)) + 1
+        labels = a.labels[rows].tolist()
+        for r, lo, hi in zip(
+            owners[np.concatenate(([0], bounds))].tolist(),
+            [0, *bounds.tolist()],
+            [*bounds.tolist(), len(labels)],
+        ):
+            text[r] = "".join(labels[lo:hi])
+    return [text[r] for r in idx.tolist()]
+
+
+def _rows(result, limit=None):
+    a = result.arrays
+    if not a.recipes:
+        return []
+    # only the returned recipes are gathered and labelled
+    idx = result.order[:limit]
+    columns = zip(
+        [a.recipes[r] for r in idx.tolist()],
+        a.counts[idx].tolist(),
+        result.missing_ingredients[idx].tolist(),
+        result.expiring_within_scope[idx].tolist(),
+        _expiring_text(a, result.expiring, idx),
+        [a.price_per_portion[r] for r in idx.tolist()],
+        result.price[idx].tolist(),
+        result.cost[idx].tolist(),
+    )
+    return [
+        {
+            "recipe": recipe,
+            "nbr_of_ingredients": count,
+            "missing_ingredients": missing,
+            "expiring_within_scope": nbr_expiring,
+            "expiring_ingredients": expiring_text,
+            "price_per_portion": price_per_portion,
+            "price": price,
+            "cost": cost,
+        }
+        for recipe, count, missing, nbr_expiring, expiring_text, price_per_portion, price, cost in columns
+    ]
+
+
+def _subset(a, recipes: List[str]):
+    """The snapshot restricted to the given recipes, kept in name order."""
+    positions = {name: r for r, name in enumerate(a.recipes)}
+    unknown = [name for name in recipes if name not in positions]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown recipes: {', '.join(unknown)}")
+    idx = np.array(sorted({positions[name] for name in recipes}), dtype=np.int64)
+
+    s = SimpleNamespace(version=a.version, diet_masks=a.diet_masks)
+    # whole ingredient columns, for the pooled stock
+    s.ing_name, s.stock_g, s.expiry = a.ing_name, a.stock_g, a.expiry
+    s.recipes = [a.recipes[r] for r in idx.tolist()]
+    s.counts = a.counts[idx]
+    s.starts = np.concatenate(([0], np.cumsum(s.counts)[:-1])).astype(np.int64)
+    s.portions = a.portions[idx]
+    s.masks = a.masks[idx]
+    s.row_recipe = np.repeat(np.arange(len(idx)), s.counts)
+    rows = _recipe_rows(a, idx)
+    for name in ("ing_idx", "quantity", "row_grams", "row_name", "row_price_per_unit", "row_expiry", "row_has_expiry",
+                 "row_price", "row_price_per_g", "labels"):
+        setattr(s, name, getattr(a, name)[rows])
+    s.price_per_portion = [a.price_per_portion[r] for r in idx.tolist()]
+    return s
+
+
+suggestion_engine = SuggestionEngine()
+
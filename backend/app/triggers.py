@@ -0,0 +1,48 @@
+def changed_rows_trigger(table, name, key, columns, statements):
+    """
+    DDL for statement-level triggers on `table` that collect the `key` of
+    every inserted, deleted or updated row into the text[] variable
+    `changed`, then run `statements` (PL/pgSQL) when it is not empty.
+
+    For updates only rows whose `columns` actually changed are collected,
+    so unrelated updates (e.g. stock levels) cost nothing. The transition
+    tables make this one set-based pass per statement, even for COPY.
+    """
+    cols = ", ".join(columns)
+    function = f"{table}_{name}"
+    body = "\n".join(f"            {s};" for s in statements)
+    sql = [f"""
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+    DECLARE
+        changed text[];
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            changed := ARRAY(SELECT DISTINCT {key} FROM new_rows);
+        ELSIF TG_OP = 'DELETE' THEN
+            changed := ARRAY(SELECT DISTINCT {key} FROM old_rows);
+        ELSE
+            changed := ARRAY(
+                SELECT {key} FROM (SELECT {cols} FROM new_rows EXCEPT SELECT {cols} FROM old_rows) n
+                UNION
+                SELECT {key} FROM (SELECT {cols} FROM old_rows EXCEPT SELECT {cols} FROM new_rows) o
+            );
+        END IF;
+        IF cardinality(changed) > 0 THEN
+{body}
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """]
+    for event, referencing in [
+        ("INSERT", "NEW TABLE AS new_rows"),
+        ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ("DELETE", "OLD TABLE AS old_rows"),
+    ]:
+        sql.append(f"""
+        CREATE OR REPLACE TRIGGER {function}_{event.lower()}
+        AFTER {event} ON {table}
+        REFERENCING {referencing}
+        FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+        """)
+    return sql
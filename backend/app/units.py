@@ -0,0 +1,50 @@
+from sqlalchemy import text
+
+from .triggers import changed_rows_trigger
+
+
+# The same ingredient can be stocked and used in several units (basil in
+# leaves and in tbsp): ingredients are keyed on (name, unit). Quantities are
+# also kept in grams, the canonical unit, so availability, costs and
+# shopping pool every unit of an ingredient by name:
+#   ingredients.stock_in_grams       generated column, quantity_on_stock * g_per_unit
+#   instructions.quantity_in_grams   quantity * g_per_unit of its ingredient row
+#   instructions.recipe_grams        sum of quantity_in_grams over the recipe's
+#                                    rows of the same ingredient
+# The instruction columns are maintained by the triggers below.
+
+def _set_grams(where):
+    # `where` must select whole recipes or whole ingredients, so every sum is complete
+    return f"""
+        UPDATE instructions m
+        SET quantity_in_grams = g.quantity_in_grams, recipe_grams = g.recipe_grams
+        FROM (
+            SELECT m.recipe, m.ingredient, m.unit, m.quantity * i.g_per_unit AS quantity_in_grams,
+                   SUM(m.quantity * i.g_per_unit) OVER (PARTITION BY m.recipe, m.ingredient) AS recipe_grams
+            FROM instructions m
+            JOIN ingredients i ON i.name = m.ingredient AND i.unit = m.unit
+            WHERE {where}
+        ) g
+        WHERE (m.recipe, m.ingredient, m.unit) = (g.recipe, g.ingredient, g.unit)
+          AND (m.quantity_in_grams, m.recipe_grams) IS DISTINCT FROM (g.quantity_in_grams, g.recipe_grams)
+    """
+
+
+def install_unit_triggers(connection):
+    """
+    Fill the gram columns of instructions and keep them current when quantities,
+    units or g_per_unit change. Filled before the triggers exist, so the bulk
+    UPDATE does not run them. PostgreSQL only.
+    """
+    connection.execute(text(_set_grams("TRUE")))
+    # The UPDATEs only touch the gram columns, which the triggers ignore, so they do not recurse
+    statements = changed_rows_trigger(
+        "instructions", "grams_refresh", "recipe", ["recipe", "ingredient", "unit", "quantity"],
+        [_set_grams("m.recipe = ANY(changed)").strip()],
+    )
+    statements += changed_rows_trigger(
+        "ingredients", "grams_refresh", "name", ["name", "unit", "g_per_unit"],
+        [_set_grams("m.ingredient = ANY(changed)").strip()],
+    )
+    for statement in statements:
+        connection.execute(text(statement))
@@ -0,0 +1,181 @@
+"""
+Synthetic seed CSVs at any scale, in the format of backend/data.
+
+    python -m benchmarks.dataset --rows 1000000 --out /tmp/cookbook-1m
+
+Every reference resolves (instructions -> recipes and ingredients with the
+right unit, ingredients -> nutrient groups, menu_plan -> recipes), and the
+distributions are skewed like real cookbooks: ingredient use follows a Zipf
+law (a few staples are in most recipes), recipe sizes are log-normal,
+most stock levels are zero and a share of ingredients never expires.
+"""
+import argparse
+import csv
+import math
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+
+# unit -> (share of ingredients, g_per_unit, typical quantity in a recipe)
+UNITS = {
+    "g": (0.25, 1, 150),
+    "ml": (0.07, 1, 100),
+    "cups": (0.18, 200, 1),
+    "pieces": (0.16, 120, 2),
+    "tbsp": (0.13, 15, 2),
+    "tsp": (0.15, 5, 1),
+    "pinches": (0.03, 0.5, 1),
+    "cloves": (0.03, 5, 3),
+}
+STORES = (["Coop", "Migros", "Aldi", "Lidl"], [0.45, 0.35, 0.12, 0.08])
+DIETS = [
+    ("Lactose", "Lactose-free diet"),
+    ("Gluten", "Gluten-free diet"),
+    ("Animal Products", "Vegan diet"),
+    ("Animal Products", "Vegetarian diet"),
+    ("Nuts", "Nut-free diet"),
+]
+ZIPF_EXPONENT = 1.1
+MEALS_PER_DAY = 3
+
+
+def table_sizes(rows):
+    """Row counts per table for a dataset of about `rows` rows in total."""
+    n_instructions = rows
+    for _ in range(3):
+        n_recipes = max(3, n_instructions // 9)
+        n_ingredients = max(20, min(int(30 * math.sqrt(n_recipes)), n_instructions // 3))
+        sizes = {
+            "nutrients": max(5, n_ingredients // 3),
+            "ingredients": n_ingredients,
+            "recipes": n_recipes,
+            "instructions": n_instructions,
+            "diets": len(DIETS),
+            "preferences": max(1, n_ingredients // 20),
+            "menu_plan": MEALS_PER_DAY * max(7, min(3650, n_recipes // 3)),
+        }
+        n_instructions = max(10, int(n_instructions * rows / sum(sizes.values())))
+    return sizes
+
+
+def _zipf_weights(n, rng):
+    weights = 1.0 / np.arange(1, n + 1) ** ZIPF_EXPONENT
+    # popularity is unrelated to the name order
+    return weights[rng.permutation(n)] / weights.sum()
+
+
+def _write(out_dir, name, header, rows):
+    with open(os.path.join(out_dir, name), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate(out_dir, rows, seed=0, today=None):
+    """Write the seven seed CSVs to out_dir; returns the row count per table."""
+    rng = np.random.default_rng(seed)
+    today = today or date.today()
+    sizes = table_sizes(rows)
+    n_groups, n_ingredients, n_recipes = sizes["nutrients"], sizes["ingredients"], sizes["recipes"]
+
+    _write(out_dir, "nutrients.csv", [
+        "Ingredient_Group", "kcal", "kJ", "graisses", "acides_gras_satures", "acides_gras_mono_insatures",
+        "acides_gras_polyinsatures", "cholesterol_mg", "glucides", "sucres", "amidon",
+        "fibres_alimentaires", "proteines", "sel",
+    ], (
+        [f"group {g}", round(kcal), round(kcal * 4.184)] + np.round(rng.uniform(0, 30, 11), 1).tolist()
+        for g, kcal in enumerate(rng.gamma(2.0, 90.0, n_groups).tolist())
+    ))
+
+    units = list(UNITS)
+    unit_idx = rng.choice(len(units), n_ingredients, p=[UNITS[u][0] for u in units])
+    has_stock = rng.random(n_ingredients) < 0.4
+    stock = np.where(has_stock, np.round(rng.lognormal(3, 1.2, n_ingredients)), 0)
+    days = rng.normal(45, 60, n_ingredients).clip(-60, 365).astype(int)
+    expires = rng.random(n_ingredients) < 0.85
+    price = np.round(rng.lognormal(-1, 1.1, n_ingredients), 4).clip(0.001)
+    store_idx = rng.choice(len(STORES[0]), n_ingredients, p=STORES[1])
+    group_idx = rng.integers(0, n_groups, n_ingredients)
+    _write(out_dir, "ingredients.csv", [
+        "Ingredient", "Group", "Unit", "g_Per_Unit", "Price_Per_Unit", "Store", "Quantity_On_Stock", "Expiration_Date",
+    ], (
+        [
+            f"ingredient {i}", f"group {g}", units[u], UNITS[units[u]][1], p, STORES[0][s], q,
+            (today + timedelta(days=d)).strftime("%Y/%m/%d") if e else "None",
+        ]
+        for i, (g, u, p, s, q, d, e) in enumerate(zip(
+            group_idx.tolist(), unit_idx.tolist(), price.tolist(), store_idx.tolist(),
+            stock.tolist(), days.tolist(), expires.tolist(),
+        ))
+    ))
+
+    portions = rng.choice([1, 2, 4, 6, 8, 10], n_recipes, p=[0.05, 0.3, 0.35, 0.15, 0.1, 0.05])
+    _write(out_dir, "recipes.csv", ["Nom", "Instructions", "Portions"], (
+        [f"recipe {r}", f"[recipe {r}](recipe-{r}.pdf)", p] for r, p in enumerate(portions.tolist())
+    ))
+
+    # (recipe, ingredient) pairs drawn with Zipf popularity. Staples are drawn
+    # twice for the same recipe often enough that we oversample, drop the
+    # duplicates and thin out uniformly to the target
+    target = sizes["instructions"]
+    recipe_sizes = rng.lognormal(2.1, 0.45, n_recipes)
+    recipe_sizes = np.maximum(1, np.round(recipe_sizes * target / recipe_sizes.sum() * 1.6)).astype(np.int64)
+    owners = np.repeat(np.arange(n_recipes), recipe_sizes)
+    picks = rng.choice(n_ingredients, len(owners), p=_zipf_weights(n_ingredients, rng))
+    pairs = np.unique(owners * n_ingredients + picks)
+    if len(pairs) > target:
+        pairs = np.sort(rng.choice(pairs, target, replace=False))
+    owners, picks = pairs // n_ingredients, pairs % n_ingredients
+    quantity = np.array([UNITS[u][2] for u in units])[unit_idx[picks]] * rng.lognormal(0, 0.5, len(picks))
+    preparations = ["chopped", "diced", "sliced", "grated", "whole", "minced", ""]
+    _write(out_dir, "instructions.csv", ["Recipe", "Ingredient", "Quantity", "Unit", "Preparation"], (
+        [f"recipe {r}", f"ingredient {i}", round(q, 1) or 0.1, units[u], preparations[p]]
+        for r, i, q, u, p in zip(
+            owners.tolist(), picks.tolist(), quantity.tolist(), unit_idx[picks].tolist(),
+            rng.integers(0, len(preparations), len(picks)).tolist(),
+        )
+    ))
+
+    _write(out_dir, "diets.csv", ["Problematic_Component", "Diet"], DIETS)
+
+    components = sorted({c for c, _ in DIETS})
+    flagged = rng.choice(n_ingredients, sizes["preferences"], replace=False)
+    _write(out_dir, "preferences.csv", ["Problematic_Component", "Ingredient"], (
+        [components[c], f"ingredient {i}"]
+        for i, c in zip(flagged.tolist(), rng.integers(0, len(components), len(flagged)).tolist())
+    ))
+
+    # Popular recipes come back often; one row per (date, meal)
+    n_days = sizes["menu_plan"] // MEALS_PER_DAY
+    day = np.repeat(np.arange(n_days), MEALS_PER_DAY)
+    meal = rng.choice(n_recipes, len(day), p=_zipf_weights(n_recipes, rng))
+    plan = np.unique(day * n_recipes + meal)
+    _write(out_dir, "menu_plan.csv", ["Date", "Meal", "Portions"], (
+        [(today + timedelta(days=d)).strftime("%Y/%m/%d"), f"recipe {m}", p]
+        for d, m, p in zip(
+            (plan // n_recipes).tolist(), (plan % n_recipes).tolist(),
+            rng.choice([1, 2, 4], len(plan)).tolist(),
+        )
+    ))
+
+    return dict(sizes, instructions=len(pairs), menu_plan=len(plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="approximate total row count")
+    parser.add_argument("--out", required=True, help="directory for the CSVs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    counts = generate(args.out, args.rows, args.seed)
+    for table, count in counts.items():
+        print(f"{table:<12} {count:>10,}")
+    print(f"{'total':<12} {sum(counts.values()):>10,}")
+
+
+if __name__ == "__main__":
+    main()
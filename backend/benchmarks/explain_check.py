@@ -0,0 +1,142 @@
+"""
+Query plan regression check: EXPLAIN (ANALYZE, BUFFERS) the hot queries and
+fail on the plan shapes that blow up with the data: a table scanned again for
+every outer row of a nested loop, a subplan run once per row, or a selective
+lookup that no longer goes through its index.
+
+    python -m benchmarks.explain_check                  # current DATABASE_URL
+    python -m benchmarks.explain_check --rows 1000000   # wipe, seed synthetic data, check
+
+Plans only mean something at scale: on the ~200 row sample data every
+table fits in a page and sequential scans are the right call. Whole-table
+aggregates (the suggestions) may pick any access method; only their
+re-scans count. Exits with status 1 on any problem, so it can gate CI;
+tests/test_explain_check.py runs the same checks under pytest.
+"""
+import argparse
+import json
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.main import SUGGESTIONS_SQL
+from app.shopping import SHOPPING_LIST_SQL
+from app.stock import CONSUME_RECIPE_SQL
+
+
+# name -> (sql, parameters, relations a selective query must read through an index)
+CHECKS = {
+    # read every instruction: a seq scan is as good as an index scan here
+    "suggestions": (SUGGESTIONS_SQL, {"portions": 4, "scope": 7, "exclude": 0}, []),
+    "suggestions_with_diets": (SUGGESTIONS_SQL, {"portions": 4, "scope": 7, "exclude": 5}, []),
+    # what the nutrition and exclusion triggers run for a changed ingredient
+    "recipes_of_ingredients": (
+        text("SELECT DISTINCT recipe FROM instructions WHERE ingredient = ANY(:names)"),
+        {"names": ["ingredient 0", "ingredient 1", "ingredient 2"]},
+        ["instructions"],
+    ),
+    # what the nutrition trigger runs for a changed nutrient group
+    "ingredients_of_groups": (
+        text('SELECT name FROM ingredients WHERE "group" = ANY(:groups)'),
+        {"groups": ["group 0", "group 1"]},
+        ["ingredients"],
+    ),
+    "expiring_ingredients": (
+        text("SELECT name, unit FROM ingredients WHERE expiration_date BETWEEN CURRENT_DATE AND CURRENT_DATE + :days"),
+        {"days": 2},
+        ["ingredients"],
+    ),
+    "shopping_list": (
+        SHOPPING_LIST_SQL,
+        {"start_date": date.today(), "end_date": date.today() + timedelta(days=7)},
+        ["menu_plan", "instructions"],
+    ),
+    # a write: EXPLAIN ANALYZE runs it, the connection rolls it back
+    "cook_recipe": (
+        CONSUME_RECIPE_SQL,
+        {"recipe": "recipe 0", "portions": None, "all_or_nothing": False,
+         "expected_ingredients": [], "expected_units": [], "expected_versions": []},
+        ["instructions", "ingredients"],
+    ),
+}
+
+
+def plan_nodes(node, processes=1):
+    """Every node with the number of processes running it (workers below a Gather)."""
+    yield node, processes
+    if node["Node Type"] in ("Gather", "Gather Merge"):
+        processes = node.get("Workers Launched", 0) + 1
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child, processes)
+
+
+def problems(plan, indexed):
+    found = []
+    for node, processes in plan_nodes(plan):
+        loops = node.get("Actual Loops", 1) / processes
+        if node["Node Type"] == "Seq Scan":
+            if loops > 1:
+                found.append(f"Seq Scan on {node['Relation Name']} repeated {loops:,.0f} times")
+            elif node["Relation Name"] in indexed:
+                found.append(f"Seq Scan on {node['Relation Name']}")
+        # InitPlans run once; a SubPlan runs for every row that reaches it
+        if node.get("Parent Relationship") == "SubPlan" and loops > 1:
+            found.append(f"{node.get('Subplan Name', 'SubPlan')} run {loops:,.0f} times")
+    return found
+
+
+def explain(connection, sql, params):
+    statement = text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql.text)
+    return connection.execute(statement, params).scalar_one()[0]
+
+
+def run_checks(connection):
+    """(name, EXPLAIN result, problems found) for every query of CHECKS."""
+    for name, (sql, params, indexed) in CHECKS.items():
+        result = explain(connection, sql, params)
+        yield name, result, problems(result["Plan"], indexed)
+
+
+def seed_synthetic(rows):
+    from app.seed import seed_data
+    from benchmarks.dataset import generate
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate(data_dir, rows)
+        seed_data(data_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, help="first wipe the database and seed a synthetic dataset of this size")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    if args.rows:
+        seed_synthetic(args.rows)
+
+    failed = False
+    with engine.connect() as connection:
+        n_instructions = connection.execute(text("SELECT COUNT(*) FROM instructions")).scalar_one()
+        if n_instructions < 100_000:
+            print(f"warning: only {n_instructions:,} instructions; seq scans are expected at this size "
+                  f"(use --rows 1000000)", file=sys.stderr)
+
+        for name, result, found in run_checks(connection):
+            plan = result["Plan"]
+            failed = failed or bool(found)
+            print(f"{'FAIL' if found else 'ok':<5} {name:<24} {result['Execution Time']:10.1f} ms"
+                  f"  shared hit {plan.get('Shared Hit Blocks', 0):>8,}  read {plan.get('Shared Read Blocks', 0):>7,}")
+            for problem in found:
+                print(f"      {problem}")
+            if args.verbose:
+                print(json.dumps(plan, indent=2))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
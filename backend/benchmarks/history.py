@@ -0,0 +1,130 @@
+"""
+Menu plan history analytics over a multi-year plan.
+
+    python -m benchmarks.history --rows 100000 --years 5 --meals-per-day 20
+
+Adds --years of planned meals ending yesterday to the data in DATABASE_URL
+(or to a freshly seeded synthetic dataset with --rows), then times the
+/menu-plan/analytics endpoints over the last month, the last year and the
+whole history: first on the live monthly partitions, then after archiving
+all but the last --keep-months into weekly summary rows. Also shows how
+many partitions a one-month range reads. Exits with status 1 when a p50 is
+above --budget-ms, so it can gate CI.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.history import archive_menu_plan, ensure_partitions, months_ago
+from benchmarks.explain_check import seed_synthetic
+
+
+# :per_day distinct-ish recipes a day, picked by hash; duplicates collapse on the PK
+GENERATE_HISTORY_SQL = text("""
+    WITH names AS (SELECT array_agg(name ORDER BY name) AS a FROM recipes)
+    INSERT INTO menu_plan (date, meal, portions)
+    SELECT d::date, names.a[1 + abs(hashtext(d::text || '/' || k)) % array_length(names.a, 1)], 1 + k % 4
+    FROM names,
+         generate_series(CAST(:first AS date), CAST(:last AS date), interval '1 day') AS d,
+         generate_series(1, :per_day) AS k
+    ON CONFLICT DO NOTHING
+""")
+
+ENDPOINTS = ["weekly-cost", "top-recipes", "ingredients"]
+
+
+def generate_history(years, per_day):
+    last = date.today() - timedelta(days=1)
+    first = last - timedelta(days=round(365.25 * years))
+    with engine.begin() as connection:
+        ensure_partitions(connection, first, last)
+        count = connection.execute(GENERATE_HISTORY_SQL, {"first": first, "last": last, "per_day": per_day}).rowcount
+        connection.execute(text("ANALYZE menu_plan"))
+    print(f"{count:,} planned meals from {first} to {last}")
+    return first, last
+
+
+def partitions_read(first, last):
+    # partitions left in the plan once pruning is done
+    with engine.connect() as connection:
+        plan = connection.execute(
+            text("EXPLAIN (FORMAT JSON) SELECT * FROM menu_plan WHERE date BETWEEN :first AND :last"),
+            {"first": first, "last": last},
+        ).scalar_one()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    names = set()
+
+    def walk(node):
+        if node.get("Relation Name"):
+            names.add(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return len(names)
+
+
+def time_endpoints(client, ranges, requests):
+    worst = 0.0
+    for label, (first, last) in ranges.items():
+        for endpoint in ENDPOINTS:
+            params = {"start_date": first.isoformat(), "end_date": last.isoformat()}
+            client.get(f"/menu-plan/analytics/{endpoint}", params=params).raise_for_status()
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(f"/menu-plan/analytics/{endpoint}", params=params).raise_for_status()
+                timings.append((time.perf_counter() - start) * 1000)
+            p50 = statistics.median(timings)
+            worst = max(worst, p50)
+            print(f"   {label:<10} {endpoint:<14} {p50:9.1f}ms")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, help="first wipe the database and seed a synthetic dataset of this size")
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--keep-months", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=10, help="timed requests per endpoint and range")
+    parser.add_argument("--budget-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    if args.rows:
+        seed_synthetic(args.rows)
+    first, last = generate_history(args.years, args.meals_per_day)
+    month = last - timedelta(days=30)
+    print(f"one month reads {partitions_read(month, last)} of {partitions_read(first, last)} partitions")
+    ranges = {
+        "month": (month, last),
+        "year": (last - timedelta(days=365), last),
+        "all": (first, last),
+    }
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        print("live partitions, p50 per request")
+        worst = time_endpoints(client, ranges, args.requests)
+        with engine.begin() as connection:
+            archive_menu_plan(connection, months_ago(args.keep_months))
+            connection.execute(text("ANALYZE menu_plan, menu_plan_archive"))
+        print(f"archived but the last {args.keep_months} months, p50 per request")
+        worst = max(worst, time_endpoints(client, ranges, args.requests))
+
+    if worst > args.budget_ms:
+        print(f"FAIL: slowest p50 {worst:.1f}ms is over {args.budget_ms:.0f}ms", file=sys.stderr)
+        sys.exit(1)
+    print(f"ok: slowest p50 {worst:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Requests/s and latency of POST /recipes/suggestions (or POST /stock/cook) at
+several concurrency levels, for the app (async handlers awaiting their queries
+on the asyncpg engine, the suggestion engine in the threadpool) against a plain
+sync reference handler on the psycopg2 engine.
+
+    python -m benchmarks.load_test --clients 1 50 500 --duration 10
+    python -m benchmarks.load_test --endpoint cook --clients 50 200 --apps async
+
+Both apps run under uvicorn (one worker each) on DATABASE_URL, so the pool
+settings of database.py (DB_POOL_SIZE, DB_MAX_OVERFLOW, ...) apply to both
+engines.
+The response cache is disabled (SUGGESTION_CACHE_SIZE=0) so every request
+reaches the database; pass --cache to measure with it. Cooking cycles through
+the first 1000 recipes, so concurrent calls contend on the staple ingredients
+the way real kitchens would; it drains the stock of the database it runs on.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+from fastapi import Depends, FastAPI, Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.cache import data_version
+from app.database import SessionLocal, get_db
+from app.main import suggestions_encoder
+from app.serialization import encode
+from app.schemas import StockRequest, SuggestionRequest
+from app.stock import consume_result, consume_statement
+from app.suggestions import suggestion_engine
+
+
+# The handler as it was before the async port: a plain def on Starlette's
+# threadpool with a Session from the sync engine
+sync_app = FastAPI()
+
+
+@sync_app.post("/recipes/suggestions")
+def sync_suggestions(request: SuggestionRequest, db: Session = Depends(get_db)):
+    rows = suggestion_engine.suggest(request, db, version=data_version())
+    return Response(content=encode(suggestions_encoder, rows), media_type="application/json")
+
+
+@sync_app.post("/stock/cook")
+def sync_cook(request: StockRequest, db: Session = Depends(get_db)):
+    expected = [e.model_dump() for e in request.expected_versions]
+    statement, params = consume_statement("cook", request.recipe, request.day, request.portions, expected)
+    rows = [dict(row._mapping) for row in db.execute(statement, params)]
+    result = consume_result("cook", request.recipe, request.day, rows)
+    db.commit()
+    return result
+
+
+APPS = {
+    "sync": ("benchmarks.load_test:sync_app", 8101),
+    "async": ("app.main:app", 8102),
+}
+ENDPOINTS = ["suggestions", "cook"]
+PAYLOAD = {"portions": 4, "scope": 7}
+
+
+def start_server(target, port, cache):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), CORS_ORIGINS=os.getenv("CORS_ORIGINS", "*"))
+    if not cache:
+        env["SUGGESTION_CACHE_SIZE"] = "0"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"], env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/openapi.json", timeout=1).raise_for_status()
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{target} did not start on port {port}")
+
+
+def requests_for(endpoint):
+    """(path, payloads) the workers cycle through."""
+    if endpoint == "suggestions":
+        return "/recipes/suggestions", [PAYLOAD]
+    with SessionLocal() as db:
+        recipes = db.execute(text("SELECT name FROM recipes ORDER BY name LIMIT 1000")).scalars().all()
+    return "/stock/cook", [{"recipe": name} for name in recipes]
+
+
+async def run_level(url, path, payloads, clients, duration):
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        next_payload = itertools.cycle(payloads).__next__
+        # warm up: loads the suggestion engine and opens a connection
+        (await client.post(path, json=next_payload())).raise_for_status()
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json=next_payload())
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="suggestions")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--apps", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--cache", action="store_true", help="keep the suggestion response cache on")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    path, payloads = requests_for(args.endpoint)
+    results = []
+    print(f"{'app':<6} {'clients':>7} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name in args.apps:
+        process, url = start_server(*APPS[name], args.cache)
+        try:
+            for clients in args.clients:
+                result = dict(app=name, endpoint=args.endpoint, **asyncio.run(run_level(url, path, payloads, clients, args.duration)))
+                results.append(result)
+                print(
+                    f"{name:<6} {clients:>7} {result['requests']:>9} {result['errors']:>7} "
+                    f"{result['rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
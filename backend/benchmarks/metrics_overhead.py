@@ -0,0 +1,42 @@
+"""
+Measure what the request instrumentation (app/metrics.py) costs.
+
+    python -m benchmarks.metrics_overhead --endpoints recipes_page suggestions --rounds 3 --requests 500
+
+Runs the benchmark suite's endpoint calls against the data already in
+DATABASE_URL, alternating fresh processes with METRICS_ENABLED=false and
+true, and prints the p50 of each setting (best of --rounds) and the relative
+overhead. The stack sampler and slow-query log stay off.
+"""
+import argparse
+import os
+
+from benchmarks.suite import ENDPOINTS, _endpoint_phase, in_fresh_process
+
+
+def measure(name, enabled, requests):
+    os.environ["METRICS_ENABLED"] = "true" if enabled else "false"
+    return in_fresh_process(_endpoint_phase, name, requests)["p50_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per process")
+    args = parser.parse_args()
+
+    os.environ["SUGGESTION_CACHE_SIZE"] = "0"
+    os.environ["SLOW_QUERY_MS"] = "0"
+    os.environ["PROFILE_SAMPLE_MS"] = "0"
+    print(f"{'endpoint':<20} {'off p50':>10} {'on p50':>10} {'overhead':>9}")
+    for name in args.endpoints:
+        off, on = [], []
+        for _ in range(args.rounds):
+            off.append(measure(name, False, args.requests))
+            on.append(measure(name, True, args.requests))
+        print(f"{name:<20} {min(off):8.2f}ms {min(on):8.2f}ms {(min(on) / min(off) - 1) * 100:8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Query count check for the recipe graph endpoints: the number of SQL
+statements per request must not grow with the number of recipes returned.
+
+    python -m benchmarks.query_count                  # current DATABASE_URL
+    python -m benchmarks.query_count --rows 100000    # wipe, seed synthetic data, check
+
+Counts the statements each request sends through the API's (async) engine for
+/recipes?include=ingredients,nutrients pages of growing size and for
+/recipes/{name}, next to what walking the same relationships lazily costs.
+Exits with status 1 when the count changes with the page size, so it can
+gate CI; benchmarks.suite runs the same check at every scale it seeds, and
+tests/test_query_count.py under pytest.
+"""
+import argparse
+import sys
+
+from sqlalchemy import event, select
+
+from app.database import SessionLocal, get_async_engine
+from app.models import Recipe
+from benchmarks.explain_check import seed_synthetic
+
+
+PAGE_SIZES = [1, 10, 50, 100, 250]
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+    def during(self, fn):
+        start = self.count
+        fn()
+        return self.count - start
+
+
+def lazy_walk(limit):
+    # what code touching the default lazy relationships costs: one query per hop
+    with SessionLocal() as db:
+        counter = StatementCounter(db.get_bind())
+        try:
+            def walk():
+                for recipe in db.execute(select(Recipe).order_by(Recipe.name).limit(limit)).scalars():
+                    for line in recipe.ingredients_list:
+                        line.ingredient_name.nutrient_info.kcal
+            return counter.during(walk)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", counter._count)
+
+
+def statement_counts(verbose=False):
+    """
+    Statements per /recipes?include=ingredients,nutrients page, by page size,
+    and per /recipes/{name} of the first recipes.
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    # handlers await their queries on the async engine; events fire on its sync core
+    engine = get_async_engine().sync_engine
+    counter = StatementCounter(engine)
+    pages, details = {}, {}
+    try:
+        with TestClient(app) as client:
+            def get(path, **params):
+                return lambda: client.get(path, params=params).raise_for_status()
+
+            names = [r["name"] for r in client.get("/recipes", params={"limit": 3, "fields": "name"}).json()]
+            if verbose:
+                print(f"{'request':<48} {'statements':>10} {'lazy walk':>10}")
+            for size in PAGE_SIZES:
+                count = pages[size] = counter.during(get("/recipes", include="ingredients,nutrients", limit=size))
+                if verbose:
+                    print(f"{f'/recipes?include=ingredients,nutrients&limit={size}':<48} {count:>10} {lazy_walk(size):>10}")
+            for name in names:
+                count = details[name] = counter.during(get(f"/recipes/{name}", portions=4))
+                if verbose:
+                    print(f"{f'/recipes/{name}'[:48]:<48} {count:>10}")
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._count)
+    return pages, details
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, help="first wipe the database and seed a synthetic dataset of this size")
+    args = parser.parse_args()
+
+    if args.rows:
+        seed_synthetic(args.rows)
+
+    counts, _ = statement_counts(verbose=True)
+    if len(set(counts.values())) > 1:
+        print("FAIL: statements per page grow with the page size", file=sys.stderr)
+        sys.exit(1)
+    print("ok: constant number of statements per page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the row-by-row ORM seed with the bulk importer on a synthetic dataset.
+
+    python -m benchmarks.seed_benchmark --rows 1000000
+
+Uses DATABASE_URL like the app. Both paths start from an empty schema.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.importer import TABLE_SPECS, import_all, read_rows
+from app.seed import reset_schema
+from benchmarks.dataset import generate
+
+
+def orm_load(data_dir):
+    """The previous seed path: one session.add() per CSV row."""
+    with Session(engine) as session:
+        for filename, model, columns in TABLE_SPECS:
+            for row in read_rows(os.path.join(data_dir, filename), columns):
+                session.add(model(**row))
+            session.commit()
+
+
+def bulk_load(data_dir):
+    with engine.begin() as connection:
+        import_all(connection, data_dir, report=lambda line: print("   ", line))
+
+
+def timed(label, fn, data_dir, n_rows):
+    reset_schema()
+    start = time.perf_counter()
+    fn(data_dir)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<6} {elapsed:8.2f}s  {n_rows / elapsed:12,.0f} rows/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="approximate total row count")
+    parser.add_argument("--skip-orm", action="store_true", help="only time the bulk importer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        counts = generate(data_dir, args.rows)
+        n_rows = sum(counts.values())
+        print(f"{engine.dialect.name}: {n_rows:,} rows ({counts['instructions']:,} instructions)")
+
+        bulk = timed("bulk", bulk_load, data_dir, n_rows)
+        if not args.skip_orm:
+            orm = timed("orm", orm_load, data_dir, n_rows)
+            print(f"speedup {orm / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
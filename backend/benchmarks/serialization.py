@@ -0,0 +1,81 @@
+"""
+Compare response encoders on instruction rows and time /instructions end to end.
+
+    python -m benchmarks.serialization --rows 100000
+
+Reads up to --rows instruction rows from DATABASE_URL as Core rows and
+encodes them the ways a handler can:
+
+  fastapi     list of dicts -> jsonable_encoder -> json.dumps (a handler
+              returning dicts, what FastAPI does without a raw Response)
+  validated   TypeAdapter(List[Instruction]) validate_python + dump_json
+  encoder     serialization.json_encoder, dump_json straight from the dicts
+
+then reports the CPU time per request of GET /instructions pages and of
+streaming every row as ndjson through the app. Seed a dataset first
+(benchmarks.dataset + app.seed.seed_data).
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Instruction
+from app.schemas import Instruction as InstructionSchema
+from app.serialization import json_encoder
+
+
+def cpu_ms(fn, repeat):
+    fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    table = Instruction.__table__
+    keys = [c.key for c in table.columns]
+    with SessionLocal() as db:
+        rows = db.execute(select(table).order_by(*table.primary_key).limit(args.rows)).all()
+    dicts = [dict(zip(keys, row)) for row in rows]
+    print(f"{len(dicts):,} instruction rows")
+
+    validated = TypeAdapter(List[InstructionSchema])
+    encoder = json_encoder(InstructionSchema)
+    encoders = {
+        "fastapi": lambda: json.dumps(jsonable_encoder(dicts)).encode(),
+        "validated": lambda: validated.dump_json(validated.validate_python(dicts)),
+        "encoder": lambda: encoder.dump_json(dicts),
+    }
+    baseline = None
+    for name, encode in encoders.items():
+        ms = cpu_ms(encode, args.repeat)
+        baseline = baseline or ms
+        print(f"   {name:<10} {ms:9.1f}ms  {baseline / ms:5.1f}x")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        def get(**params):
+            return lambda: client.get("/instructions", params=params).raise_for_status()
+
+        print("GET /instructions, CPU per request (client included)")
+        print(f"   {'page 1000':<10} {cpu_ms(get(limit=1000), 20):9.1f}ms")
+        print(f"   {'recipe':<10} {cpu_ms(get(recipe='recipe 0'), 100):9.1f}ms")
+        print(f"   {'ndjson':<10} {cpu_ms(get(format='ndjson'), 2):9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
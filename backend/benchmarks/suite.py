@@ -0,0 +1,254 @@
+"""
+Seed synthetic datasets at several scales and time seeding and every endpoint.
+
+    python -m benchmarks.suite --rows 1000 100000 1000000
+    python -m benchmarks.suite --rows 100000 --compare benchmarks/results/<earlier run>.json
+
+Each scale is generated with benchmarks.dataset and seeded through
+app.seed.seed_data (schema, triggers and views) into DATABASE_URL, which must
+be a PostgreSQL database that can be wiped. Endpoints are called in-process
+through the ASGI app with the suggestion response cache disabled. Seeding
+and each endpoint run in a fresh process, so the reported peak RSS belongs to
+that phase alone.
+
+Each scale also runs the benchmarks.query_count check; the suite exits with
+status 1 when statements per /recipes?include= page grow with its size.
+
+Results, tagged with the git commit, are written as JSON to
+benchmarks/results/ (or --output); --compare prints the p50/p99 ratio
+against an earlier file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from benchmarks.dataset import generate
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# name -> (method, path, request kwargs, timed requests)
+ENDPOINTS = {
+    "recipes_page": ("GET", "/recipes", {"params": {"limit": 100}}, 50),
+    "recipes_diets": ("GET", "/recipes", {"params": {"limit": 100, "diets": "Vegan diet"}}, 50),
+    "recipes_include": ("GET", "/recipes", {"params": {"limit": 100, "include": "ingredients,nutrients"}}, 20),
+    "recipe_detail": ("GET", "/recipes/recipe 0", {"params": {"portions": 4}}, 50),
+    "ingredients_page": ("GET", "/ingredients", {"params": {"limit": 1000}}, 50),
+    "instructions_page": ("GET", "/instructions", {"params": {"limit": 1000}}, 50),
+    "instructions_recipe": ("GET", "/instructions", {"params": {"recipe": "recipe 0"}}, 50),
+    "instructions_stream": ("GET", "/instructions", {"params": {"format": "ndjson"}}, 3),
+    "nutrition_report": ("GET", "/recipes/nutrition", {"params": {"order_by": "kcal", "limit": 50}}, 50),
+    "shopping_list": ("GET", "/shopping-list", {"params": {
+        "start_date": date.today().isoformat(), "end_date": (date.today() + timedelta(days=7)).isoformat(),
+    }}, 20),
+    "suggestions": ("POST", "/recipes/suggestions", {"json": {"portions": 4, "scope": 7}}, 20),
+    "suggestions_diets": ("POST", "/recipes/suggestions", {"json": {
+        "portions": 4, "scope": 7, "diets": ["Vegan diet", "Gluten-free diet"],
+    }}, 20),
+    "search": ("GET", "/search", {"params": {"q": "recipe 12"}}, 50),
+    "search_fuzzy": ("GET", "/search", {"params": {"q": "ingredent 12", "kind": "ingredient"}}, 50),
+    "search_ingredients": ("GET", "/search", {"params": {"ingredients": ["ingredient 1", "ingredient 2"]}}, 50),
+    # 10 portions x 5 scopes, top 20 of each
+    "suggestions_batch": ("POST", "/recipes/suggestions/batch", {"json": {
+        "scenarios": [{"portions": p, "scope": s} for p in (1, 2, 3, 4, 6, 8, 10, 12, 16, 20) for s in (1, 3, 7, 14, 30)],
+        "limit": 20,
+    }}, 10),
+    "menu_plan": ("POST", "/menu-plan/generate", {"json": {"days": 30}}, 5),
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _latency_summary(seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _count_rows(response):
+    if response.headers.get("content-type", "").startswith("application/x-ndjson"):
+        return response.text.count("\n")
+    body = response.json()
+    if isinstance(body, dict):
+        return len(body.get("items", body.get("meals", [])))
+    return len(body)
+
+
+def _seed_phase(data_dir, n_rows):
+    from app.seed import seed_data
+
+    start = time.perf_counter()
+    seed_data(data_dir)
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "rows_per_s": n_rows / elapsed, "peak_rss_mb": _peak_rss_mb()}
+
+
+def _endpoint_phase(name, requests=None):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    method, path, kwargs, default_requests = ENDPOINTS[name]
+    requests = requests or default_requests
+    with TestClient(app) as client:
+        # the first call pays for cold caches (and loading the suggestion engine)
+        start = time.perf_counter()
+        client.request(method, path, **kwargs).raise_for_status()
+        cold = time.perf_counter() - start
+
+        latencies, rows = [], 0
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+            rows += _count_rows(response)
+
+    return dict(
+        requests=requests,
+        cold_ms=cold * 1000,
+        **_latency_summary(latencies),
+        rows_per_response=rows / requests,
+        rows_per_s=rows / sum(latencies),
+        peak_rss_mb=_peak_rss_mb(),
+    )
+
+
+def _query_count_phase():
+    from benchmarks.query_count import statement_counts
+
+    pages, details = statement_counts()
+    return {"pages": pages, "details": details, "constant": len(set(pages.values())) == 1}
+
+
+def _child(queue, fn, args):
+    try:
+        queue.put(("ok", fn(*args)))
+    except Exception as e:
+        queue.put(("error", repr(e)))
+
+
+def in_fresh_process(fn, *args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, fn, args))
+    process.start()
+    status, value = queue.get()
+    process.join()
+    if status == "error":
+        raise RuntimeError(f"{fn.__name__}{args}: {value}")
+    return value
+
+
+def run_scale(rows, seed):
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        counts = generate(data_dir, rows, seed)
+        generated = time.perf_counter() - start
+        n_rows = sum(counts.values())
+        print(f"== {n_rows:,} rows (generated in {generated:.1f}s)")
+
+        seeding = in_fresh_process(_seed_phase, data_dir, n_rows)
+        print(f"   {'seed':<20} {seeding['seconds']:9.2f}s {seeding['rows_per_s']:12,.0f} rows/s"
+              f" {seeding['peak_rss_mb']:8.0f} MB")
+
+    queries = in_fresh_process(_query_count_phase)
+    print(f"   {'query count':<20} {'ok' if queries['constant'] else 'FAIL'}:"
+          f" {sorted(set(queries['pages'].values()))} statements per page")
+
+    endpoints = {}
+    for name in ENDPOINTS:
+        result = endpoints[name] = in_fresh_process(_endpoint_phase, name)
+        print(f"   {name:<20} p50 {result['p50_ms']:8.1f}ms  p99 {result['p99_ms']:8.1f}ms"
+              f" {result['rows_per_s']:12,.0f} rows/s {result['peak_rss_mb']:8.0f} MB")
+    return {
+        "rows": rows, "tables": counts, "generate_s": generated, "seed": seeding,
+        "query_count": queries, "endpoints": endpoints,
+    }
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def compare(previous, current):
+    """Print p50/p99 ratios (current / previous) per scale and endpoint."""
+    earlier = {scale["rows"]: scale for scale in previous["scales"]}
+    print(f"\nvs {previous['git']['commit'][:10]} (ratio > 1 is slower)")
+    for scale in current["scales"]:
+        old = earlier.get(scale["rows"])
+        if old is None:
+            continue
+        print(f"== {scale['rows']:,} rows")
+        print(f"   {'seed':<20} {scale['seed']['seconds'] / old['seed']['seconds']:6.2f}x")
+        for name, result in scale["endpoints"].items():
+            if name in old["endpoints"]:
+                before = old["endpoints"][name]
+                p50 = result["p50_ms"] / before["p50_ms"]
+                p99 = result["p99_ms"] / before["p99_ms"]
+                flag = "  <-- slower" if p50 > 1.2 else ""
+                print(f"   {name:<20} p50 {p50:6.2f}x  p99 {p99:6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the dataset generator")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    args = parser.parse_args()
+
+    from app.database import engine
+    if engine.dialect.name != "postgresql":
+        # seed_data installs PL/pgSQL triggers and PostgreSQL views
+        parser.error(f"DATABASE_URL must point to PostgreSQL, not {engine.dialect.name}")
+    # every suggestion request must do the work
+    os.environ["SUGGESTION_CACHE_SIZE"] = "0"
+
+    revision = git_revision()
+    results = {
+        "git": revision,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "scales": [run_scale(rows, args.seed) for rows in args.rows],
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{revision['commit'][:10]}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    if not all(scale["query_count"]["constant"] for scale in results["scales"]):
+        print("FAIL: statements per /recipes?include= page grow with the page size", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
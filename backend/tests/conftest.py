@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+# Tests marked postgres wipe and seed TEST_DATABASE_URL, never the app's
+# DATABASE_URL; without it they are skipped. Set before app.database is imported.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "sqlite://"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("CORS_ORIGINS", "*")
+# Size of the synthetic dataset: plans only mean something at scale
+TEST_ROWS = int(os.getenv("TEST_ROWS", "200000"))
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="needs PostgreSQL: set TEST_DATABASE_URL")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def synthetic_db():
+    """TEST_DATABASE_URL wiped and seeded with TEST_ROWS synthetic rows."""
+    from benchmarks.explain_check import seed_synthetic
+
+    seed_synthetic(TEST_ROWS)
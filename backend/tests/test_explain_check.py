@@ -0,0 +1,11 @@
+import pytest
+
+from app.database import engine
+from benchmarks.explain_check import run_checks
+
+
+@pytest.mark.postgres
+def test_hot_query_plans(synthetic_db):
+    with engine.connect() as connection:
+        found = {name: problems for name, _, problems in run_checks(connection) if problems}
+    assert found == {}
@@ -0,0 +1,62 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import inspect
+
+from app.listing import decode_cursor, encode_cursor
+from app.models import Instruction, Recipe
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def test_cursor_round_trip():
+    pk = list(inspect(Instruction).primary_key)
+    values = ["Omelet", "egg", "pieces"]
+    assert decode_cursor(encode_cursor(values), pk) == values
+
+
+@pytest.mark.parametrize("token", [
+    cursor([1]),                # a number for a text key
+    cursor([None]),
+    cursor([["Omelet"]]),
+    cursor(["Omelet", "egg"]),  # too many values
+    cursor({"name": "Omelet"}),
+    "not a cursor",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(token, list(inspect(Recipe).primary_key))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.postgres
+@pytest.mark.parametrize("params", [{}, {"include": "ingredients"}])
+def test_wrong_typed_cursor_is_a_bad_request(synthetic_db, params):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        response = client.get("/recipes", params={"after": cursor([1]), **params})
+    assert response.status_code == 400
+
+
+@pytest.mark.postgres
+def test_unpaginated_listing_is_every_page(synthetic_db):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        everything = client.get("/recipes", params={"fields": "name"}).json()
+        pages, after = [], None
+        while True:
+            response = client.get("/recipes", params={"fields": "name", "limit": 1000, "after": after})
+            pages += response.json()
+            after = response.headers.get("X-Next-Cursor")
+            if after is None:
+                break
+    assert everything == pages
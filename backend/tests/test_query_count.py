@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.query_count import statement_counts
+
+
+@pytest.mark.postgres
+def test_statements_do_not_grow_with_the_page(synthetic_db):
+    pages, details = statement_counts()
+    assert len(set(pages.values())) == 1, pages
+    assert len(set(details.values())) == 1, details
@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.cache import data_version
+from app.search import SearchIndex
+
+
+@pytest.fixture
+def db():
+    # the index loads with plain SQL, so SQLite will do
+    with Session(create_engine("sqlite://")) as db:
+        db.execute(text("CREATE TABLE recipes (name TEXT PRIMARY KEY, description TEXT)"))
+        db.execute(text("CREATE TABLE ingredients (name TEXT, unit TEXT, PRIMARY KEY (name, unit))"))
+        db.execute(text("CREATE TABLE instructions (recipe TEXT, ingredient TEXT, unit TEXT, preparation TEXT)"))
+        db.execute(text("INSERT INTO recipes VALUES ('Crêpes sucrées', 'Thin pancakes'), ('Omelet', NULL)"))
+        db.execute(text("INSERT INTO ingredients VALUES ('egg', 'pieces'), ('flour', 'g'), ('milk', 'ml')"))
+        db.execute(text("""
+            INSERT INTO instructions VALUES
+                ('Crêpes sucrées', 'egg', 'pieces', NULL),
+                ('Crêpes sucrées', 'flour', 'g', 'sifted'),
+                ('Omelet', 'egg', 'pieces', 'beaten')
+        """))
+        yield db
+
+
+def test_search_loads_from_plain_sql(db):
+    index = SearchIndex()
+    index.load(db, data_version("catalog"))
+
+    assert [r["name"] for r in index.search(db, "crepes", [])] == ["Crêpes sucrées"]
+    assert [r["name"] for r in index.search(db, "beaten", [], kind="recipe")] == ["Omelet"]
+    assert [r["name"] for r in index.search(db, "milk", [], kind="ingredient")] == ["milk"]
+    assert [r["name"] for r in index.search(db, None, ["egg"], kind="recipe")] == ["Omelet", "Crêpes sucrées"]
@@ -1,12 +1,12 @@
 import axios from 'axios';
 import  type  { RecipeSuggestion, SuggestionRequest } from '../types';
 // ... existing imports
-import type { Instruction } from '../types';
+import type { RecipeDetail, SearchResult } from '../types';
 
 export const queryKeys = {
   recipes: {
     suggestions: (req: any) => ['recipes', 'suggestions', req] as const,
-    instructions: () => ['recipes', 'instructions'] as const, // Key for all instructions
+    detail: (name: string, portions?: number) => ['recipes', 'detail', name, portions] as const,
   },
 };
 
@@ -22,13 +22,44 @@ const apiClient = axios.create({
     headers: { 'Content-Type': 'application/json' },
 });
 
+// last ETag and body per request, so unchanged suggestions come back as an empty 304
+const suggestionCache = new Map<string, { etag: string; data: RecipeSuggestion[] }>();
+
 export const fetchSuggestions = async (req: SuggestionRequest): Promise<RecipeSuggestion[]> => {
-    const response = await apiClient.post<RecipeSuggestion[]>(`/recipes/suggestions`, req);
+    const key = JSON.stringify(req);
+    const cached = suggestionCache.get(key);
+    const response = await apiClient.post<RecipeSuggestion[]>(`/recipes/suggestions`, req, {
+        headers: cached ? { 'If-None-Match': cached.etag } : {},
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+    });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    const etag = response.headers['etag'];
+    if (etag) {
+        suggestionCache.set(key, { etag, data: response.data });
+    }
     return response.data;
 };
 
-export const fetchInstructions = async (): Promise<Instruction[]> => {
-  const response = await apiClient.get<Instruction[]>(`/instructions`);
+// the recipe with its scaled ingredients, price and nutrition in one request
+export const fetchRecipe = async (name: string, portions?: number): Promise<RecipeDetail> => {
+  const response = await apiClient.get<RecipeDetail>(`/recipes/${encodeURIComponent(name)}`, {
+    params: { portions },
+  });
+  return response.data;
+};
+
+// ranked server-side, so the browser no longer needs every recipe to filter them
+export const searchRecipes = async (
+  q: string,
+  ingredients: string[] = [],
+  limit = 20,
+): Promise<SearchResult[]> => {
+  const response = await apiClient.get<SearchResult[]>(`/search`, {
+    params: { q: q || undefined, ingredients, limit },
+    paramsSerializer: { indexes: null }, // ingredients=a&ingredients=b
+  });
   return response.data;
 };
 
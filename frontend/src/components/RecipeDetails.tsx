@@ -1,20 +1,19 @@
 import { useParams, Link } from 'react-router-dom';
 import { useQuery } from '@tanstack/react-query';
 import Modal from './Modal';
-import { fetchInstructions, queryKeys } from '../api/client';
+import { fetchRecipe, queryKeys } from '../api/client';
 
 export default function RecipeDetails() {
   const { name } = useParams<{ name: string }>();
   const decodedName = decodeURIComponent(name || "");
 
-  const { data: ingredients, isLoading } = useQuery({
-    queryKey: queryKeys.recipes.instructions(),
-    queryFn: fetchInstructions,
-    // filter the global list for just this recipe
-    select: (allInstructions) => 
-      allInstructions.filter(item => item.recipe === decodedName),
-    staleTime: 1000 * 60 * 5, // Cache instructions for 5 minutes
+  const { data: recipe, isLoading } = useQuery({
+    queryKey: queryKeys.recipes.detail(decodedName),
+    // ingredients, price and nutrition come in one request
+    queryFn: () => fetchRecipe(decodedName),
+    staleTime: 1000 * 60 * 5, // Cache the recipe for 5 minutes
   });
+  const ingredients = recipe?.ingredients;
 
   return (
     <Modal>
@@ -25,12 +24,16 @@ export default function RecipeDetails() {
 
         {isLoading ? (
           <p>Loading ingredients...</p>
-        ) : ingredients && ingredients.length > 0 ? (
+        ) : recipe && ingredients && ingredients.length > 0 ? (
           <>
+            <p>
+              {recipe.portions} portions · {recipe.price.toFixed(2)} ({recipe.price_per_portion.toFixed(2)} per portion)
+              {recipe.nutrition && recipe.portions > 0 && ` · ${Math.round(recipe.nutrition.kcal / recipe.portions)} kcal per portion`}
+            </p>
             <h3>Ingredients</h3>
             <ul style={{ lineHeight: '1.8' }}>
               {ingredients.map((item) => (
-                <li key={item.id}>
+                <li key={`${item.ingredient}-${item.unit}`}>
                   <strong>{item.quantity} {item.unit}</strong> {item.ingredient}
                 </li>
               ))}
@@ -15,9 +15,38 @@ export interface SuggestionRequest {
 }
 
 export interface Instruction {
-  id: number;
   recipe: string;
   ingredient: string;
   quantity: number;
   unit: string;
-}
\ No newline at end of file
+}
+export interface RecipeIngredient {
+  ingredient: string;
+  unit: string;
+  group: string;
+  quantity: number;
+  preparation: string | null;
+  price_per_unit: number;
+  price: number;
+  quantity_on_stock: number;
+  expiration_date: string | null;
+}
+
+export interface RecipeDetail {
+  name: string;
+  description: string;
+  portions: number;
+  recipe_portions: number;
+  price: number;
+  price_per_portion: number;
+  ingredients: RecipeIngredient[] | null;
+  nutrition: Record<string, number> | null;
+}
+
+export interface SearchResult {
+  kind: 'recipe' | 'ingredient';
+  name: string;
+  unit: string | null;
+  score: number;
+  matched: string[];
+}